@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import statistics
+import time
+
+from framing import HEADER, MAX_MESSAGE
+from voter import check_inclusion
+
+
+class HTTPConnection:
+    """One HTTP/1.1 connection, kept open across requests while the server allows.
+
+    Responses are framed by Content-Length or chunked transfer coding, so
+    each is read exactly and the next can follow on the same connection;
+    only a response with neither is read until the server closes. When
+    the server answers Connection: close (as Flask's development server
+    always does) the connection is dropped and reopened for the next request.
+    """
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    @property
+    def open(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    def encode(self, method, path, body=None):
+        payload = b'' if body is None else json.dumps(body).encode()
+        head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Length: {len(payload)}\r\n'
+        if body is not None:
+            head += 'Content-Type: application/json\r\n'
+        return head.encode() + b'\r\n' + payload
+
+    async def read_response(self):
+        """(status, headers, body) of the next response on the connection"""
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed')
+        version, status = status_line.decode('latin-1').split()[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while await self.reader.readline() not in (b'\r\n', b'\n', b''):
+                        pass  # trailers
+                    break
+                if len(body) + size > MAX_MESSAGE:
+                    raise ValueError('Response too large')
+                body += await self.reader.readexactly(size)
+                await self.reader.readexactly(2)
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read(MAX_MESSAGE)
+            headers['connection'] = 'close'
+
+        connection = headers.get('connection', '').lower()
+        if connection == 'close' or version == 'HTTP/1.0' and connection != 'keep-alive':
+            self.close()
+        return status, headers, body
+
+    async def pipeline(self, requests):
+        """Send [(method, path, body)] back to back, return their responses in order.
+
+        Requests the server didn't answer before closing the connection are
+        sent again on a new one.
+        """
+        responses = []
+        while len(responses) < len(requests):
+            fresh = not self.open
+            if fresh:
+                await self.connect()
+            pending = requests[len(responses):]
+            answered = len(responses)
+            try:
+                self.writer.write(b''.join(self.encode(*request) for request in pending))
+                await self.writer.drain()
+                for _ in pending:
+                    responses.append(await self.read_response())
+                    if not self.open:
+                        break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if fresh and len(responses) == answered:
+                    raise
+        return responses
+
+    async def request(self, method, path, body=None):
+        return (await self.pipeline([(method, path, body)]))[0]
+
+
+class ConnectionPool:
+    """Up to size HTTPConnections to one server, shared by every caller"""
+
+    def __init__(self, host, port, size=64):
+        self.host, self.port = host, port
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def pipeline(self, requests, timeout=None):
+        async with self.slots:
+            connection = self.idle.pop() if self.idle else HTTPConnection(self.host, self.port)
+            try:
+                responses = await asyncio.wait_for(connection.pipeline(requests), timeout)
+            except BaseException:
+                connection.close()  # a half-read response would garble the next one
+                raise
+            self.idle.append(connection)
+            return responses
+
+    async def json(self, method, path, body=None, timeout=None):
+        """(status, decoded JSON body) of one request"""
+        status, _, data = (await self.pipeline([(method, path, body)], timeout))[0]
+        return status, json.loads(data) if data else None
+
+
+class FramedPool:
+    """Persistent connections to a framing.FramedServer such as TP1 or TP2"""
+
+    def __init__(self, host, port, size=4):
+        self.host, self.port = host, port
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def request(self, message, timeout=60):
+        async with self.slots:
+            streams = self.idle.pop() if self.idle else await asyncio.open_connection(self.host, self.port)
+            try:
+                response = await asyncio.wait_for(self._exchange(streams, message), timeout)
+            except BaseException:
+                streams[1].close()
+                raise
+            self.idle.append(streams)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    @staticmethod
+    async def _exchange(streams, message):
+        reader, writer = streams
+        payload = json.dumps(message).encode()
+        writer.write(HEADER.pack(len(payload)) + payload)
+        await writer.drain()
+        (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if size > MAX_MESSAGE:
+            raise ValueError(f"Message of {size} bytes is too large")
+        return json.loads(await reader.readexactly(size))
+
+
+class Batcher:
+    """Coalesces concurrent single requests into one batch request.
+
+    Items submitted within delay seconds of each other, up to max_batch of
+    them, go out together through send, a coroutine taking a list of items
+    and returning a list of results in the same order.
+    """
+
+    def __init__(self, send, max_batch=256, delay=0.002):
+        self.send = send
+        self.max_batch = max_batch
+        self.delay = delay
+        self.queue = []  # (item, future)
+        self.timer = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queue.append((item, future))
+        if len(self.queue) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.queue = self.queue, []
+        if batch:
+            asyncio.ensure_future(self._send(batch))
+
+    async def _send(self, batch):
+        try:
+            results = await self.send([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class VoterNetwork:
+    """Connections shared by every voter session of a process.
+
+    Encryption and signing requests from concurrent voters are batched
+    into TP1's encrypt_votes and TP2's blind_sign_batch.
+    """
+
+    def __init__(self, miners, tp1=("127.0.0.1", 5001), tp2=("127.0.0.1", 5002), connections=64):
+        self.miners = list(miners)
+        self.pools = {miner: ConnectionPool(*miner, size=connections) for miner in self.miners}
+        self.tp1 = FramedPool(*tp1)
+        self.tp2 = FramedPool(*tp2)
+        self.encryptions = Batcher(self._encrypt)
+        self.signatures = Batcher(self._sign)
+
+    async def _encrypt(self, messages):
+        return (await self.tp1.request({"type": "encrypt_votes", "messages": messages}))["encrypted_votes"]
+
+    async def _sign(self, hashes):
+        response = await self.tp2.request({"type": "blind_sign_batch", "hashes": hashes})
+        return [(signature, response["signerID"]) for signature in response["signatures"]]
+
+    async def encrypt(self, message):
+        return await self.encryptions.submit(message)
+
+    async def sign(self, hash_hex):
+        """(signature, signer_id)"""
+        return await self.signatures.submit(hash_hex)
+
+
+class AsyncVoter:
+    """voter.Voter's protocol as a coroutine, so thousands can share one process"""
+
+    def __init__(self, voter_id, candidate_id, network, m, confirmations=1, timeout=120, verbose=False):
+        self.voter_id = voter_id
+        self.candidate_id = candidate_id
+        self.network = network
+        self.m = m
+        self.confirmations = confirmations
+        self.timeout = timeout
+        self.verbose = verbose
+        self.encrypted_vote = None
+        self.unblinded_signed_hash = None
+        self.signer_id = None
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def vote_package(self):
+        return {
+            "signer_id": self.signer_id,
+            "encrypted_vote": self.encrypted_vote.hex(),
+            "signed_hash": self.unblinded_signed_hash
+        }
+
+    async def run(self):
+        """Vote, then wait for the vote to be confirmed; raises on failure"""
+        message = json.dumps({
+            "voter_id": self.voter_id,
+            "candidate": self.candidate_id,
+            "timestamp": time.time()
+        })
+        self.encrypted_vote = bytes.fromhex(await self.network.encrypt(message))
+        self.unblinded_signed_hash, self.signer_id = await self.network.sign(
+            hashlib.sha256(self.encrypted_vote).hexdigest())
+        await self.broadcast_vote()
+        return await self.confirm_vote_inclusion()
+
+    async def add_vote(self, miner, vote):
+        try:
+            _, response = await self.network.pools[miner].json(
+                "POST", "/vote/add", {"type": "add_vote", "vote": vote}, timeout=10)
+            return (response or {}).get("status") == "received"
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            self.log(f"⚠️ Couldn't reach miner {miner}: {e}")
+            return False
+
+    async def broadcast_vote(self):
+        """Send the vote to m miners at once, moving on to the next miner for each that fails"""
+        vote = self.vote_package()
+        untried = random.sample(self.network.miners, len(self.network.miners))
+        pending = {asyncio.ensure_future(self.add_vote(untried.pop(), vote))
+                   for _ in range(min(self.m, len(untried)))}
+        successes = 0
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    successes += 1
+                elif untried:
+                    pending.add(asyncio.ensure_future(self.add_vote(untried.pop(), vote)))
+            if successes >= self.m:
+                for task in pending:
+                    await task  # let them finish so their connections stay usable
+                self.log(f"✅ Vote from {self.voter_id} accepted by {self.m} miners")
+                return True
+        raise Exception(f"Only reached {successes}/{self.m} required miners")
+
+    async def confirm_vote_inclusion(self):
+        """Long-poll the miners until the vote is confirmations deep, return its block"""
+        deadline = time.monotonic() + self.timeout
+        mined = None
+        while time.monotonic() < deadline:
+            for miner in self.network.miners:
+                wait = max(1, min(30, int(deadline - time.monotonic())))
+                confirmations = self.confirmations if mined else 1
+                try:
+                    status, response = await self.network.pools[miner].json(
+                        "GET", f"/votes/{self.unblinded_signed_hash}/wait?confirmations={confirmations}&timeout={wait}",
+                        timeout=wait + 5)
+                except (OSError, ValueError, asyncio.TimeoutError):
+                    continue
+                if status != 200:
+                    continue
+                if mined != response["block"]:
+                    mined = response["block"]
+                    self.log(f"⛏️ {self.voter_id} vote mined in block {mined}")
+                if response["confirmations"] >= self.confirmations:
+                    if await self.verify_inclusion(miner) >= self.confirmations:
+                        self.log(f"✅ {self.voter_id} vote confirmed in block {mined}")
+                        return mined
+                    self.log(f"⚠️ {self.voter_id} couldn't verify inclusion proof from miner {miner}")
+            await asyncio.sleep(1)
+        raise Exception(f"Vote not confirmed in blockchain after {self.timeout} seconds")
+
+    async def verify_inclusion(self, miner):
+        """Confirmations the miner's proof and headers establish, 0 if they don't check out"""
+        pool = self.network.pools[miner]
+        try:
+            status, proof = await pool.json("GET", f"/votes/{self.unblinded_signed_hash}/proof", timeout=10)
+            if status != 200:
+                return 0
+            status, headers = await pool.json("GET", f"/headers?start={proof['header']['index']}", timeout=10)
+            if status != 200:
+                return 0
+            headers = headers["headers"]
+        except (OSError, ValueError, KeyError, TypeError, asyncio.TimeoutError):
+            return 0
+        return check_inclusion(self.vote_package(), proof, headers)
+
+
+async def run_voters(count, candidates, network, m, confirmations, concurrency, verbose):
+    """Run count voter sessions, at most concurrency at a time, and summarize them"""
+    slots = asyncio.Semaphore(concurrency)
+    latencies, failures = [], []
+
+    async def session(i):
+        async with slots:
+            voter = AsyncVoter(f"Voter{i}", random.choice(candidates), network, m, confirmations, verbose=verbose)
+            started = time.monotonic()
+            try:
+                await voter.run()
+                latencies.append(time.monotonic() - started)
+            except Exception as e:
+                failures.append(str(e))
+                print(f"❌ Voting failed for Voter{i}: {e}")
+
+    started = time.monotonic()
+    await asyncio.gather(*(session(i) for i in range(1, count + 1)))
+    elapsed = time.monotonic() - started
+    return {
+        'voters': count,
+        'confirmed': len(latencies),
+        'failed': len(failures),
+        'elapsed': elapsed,
+        'votes_per_sec': len(latencies) / elapsed if elapsed else None,
+        'latency_median': statistics.median(latencies) if latencies else None,
+        'latency_max': max(latencies) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many voter sessions from one process")
+    parser.add_argument("-n", "--voters", type=int, default=100, help="Voter sessions to run")
+    parser.add_argument("--candidates", default="Candidate A,Candidate B", help="Comma-separated candidates to pick from")
+    parser.add_argument("--miners", default="127.0.0.1:6001,127.0.0.1:6002,127.0.0.1:6003",
+                        help="Comma-separated HOST:PORT of the miners")
+    parser.add_argument("-m", type=int, default=2, help="Miners that must accept each vote")
+    parser.add_argument("--confirmations", type=int, default=1, help="Blocks to wait for on top of the vote")
+    parser.add_argument("--concurrency", type=int, default=1000, help="Voter sessions in flight at once")
+    parser.add_argument("--connections", type=int, default=64, help="Connections per miner")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print each voter's progress")
+    args = parser.parse_args()
+
+    miners = [(host, int(port)) for host, _, port in (m.rpartition(':') for m in args.miners.split(','))]
+    candidates = args.candidates.split(',')
+
+    async def run():
+        network = VoterNetwork(miners, connections=args.connections)
+        return await run_voters(args.voters, candidates, network, args.m, args.confirmations,
+                                args.concurrency, args.verbose)
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import codec
+from chainview import ChainView
+from framing import recv_message, send_message
+from mempool import Mempool
+from pow import Blockchain
+from tp1 import TP1Server
+from tp2 import TP2Server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentiles(samples):
+    """Nearest-rank p50/p90/p99 and max of samples, None when there are none"""
+    if not samples:
+        return None
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': samples[-1]}
+
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+
+def deep_size(*objects):
+    """Rough bytes held by objects and everything reachable through their containers"""
+    seen, total = set(), 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif isinstance(obj, ChainView):
+            stack.extend(obj)
+        elif isinstance(obj, Mempool):
+            stack.extend((obj.votes, obj.keys, obj.leaves))
+    return total
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ballots(count, seed):
+    """The plaintext messages of count voters, the way voter.py phrases them"""
+    rng = random.Random(seed)
+    return [json.dumps({"voter_id": f"bench{i}", "candidate": rng.choice("ABC"), "timestamp": i})
+            for i in range(count)]
+
+
+def make_votes(messages, encrypt, sign, signer_id):
+    """Encrypt and sign messages, return (votes, stats) with TP1 and TP2 throughput"""
+    started = time.perf_counter()
+    encrypted = encrypt(messages)
+    encrypted_at = time.perf_counter()
+    signatures = sign([hashlib.sha256(bytes.fromhex(c)).hexdigest() for c in encrypted])
+    signed_at = time.perf_counter()
+    votes = [{'signer_id': signer_id, 'encrypted_vote': c, 'signed_hash': s}
+             for c, s in zip(encrypted, signatures)]
+    stats = {
+        'encrypt_votes_per_sec': rate(len(messages), encrypted_at - started),
+        'sign_votes_per_sec': rate(len(messages), signed_at - encrypted_at),
+    }
+    return votes, stats
+
+
+class SimNode(Blockchain):
+    """A Blockchain whose peers are other nodes of the same Cluster.
+
+    Everything that would go over HTTP is a direct call into the peer, and
+    background work (announcements, resolves) is queued on the cluster
+    instead of a thread pool, so runs are driven one step at a time.
+    Blocks and messages are round-tripped through their wire encoding so
+    nodes never share mutable state.
+    """
+
+    def __init__(self, cluster, name):
+        self.cluster = cluster
+        self.name = name
+        super().__init__()
+        self.peer_pool = self.resolver = cluster
+
+    def mine(self):
+        started = time.perf_counter()
+        block = self.new_block(0, None)
+        self.cluster.mining_time += time.perf_counter() - started
+        if block is not None:
+            self.cluster.hashes += block['nonce'] + 1  # nonces are searched upwards from 0
+            self.cluster.mined.add(self.block_hash(block))
+        return block
+
+    def send_announcement(self, node, message):
+        self.cluster.nodes[node].receive_block(json.loads(json.dumps(message)), origin=self.name)
+
+    def fetch_votes(self, origin, index, positions):
+        votes = self.cluster.nodes[origin].chain[index - 1]['votes']
+        return json.loads(json.dumps([votes[p] for p in positions]))
+
+    def fetch_chain(self, node, locator, min_work):
+        peer = self.cluster.nodes[node]
+        if peer.total_work <= min_work:
+            return None
+        fork = peer.find_fork(locator)
+        blocks = [codec.decode_block(codec.encode_block(b)) for b in peer.chain[fork:]]
+        return fork, self.chain.spliced(fork, blocks)
+
+    def replace_chain(self, chain, fork):
+        self.cluster.reorgs += 1
+        super().replace_chain(chain, fork)
+
+
+class Cluster:
+    """N SimNodes on a virtual clock that only moves when step() says so.
+
+    Given the same seed and parameters, the same votes reach the same nodes,
+    the same nodes find blocks in the same rounds, and messages are delivered
+    in the same order, so block counts, fork rates, reorgs and latencies in
+    rounds repeat run to run. What gets hashed doesn't: TP1 and TP2 make
+    fresh keys, OAEP padding is random and the genesis block is stamped
+    with the real time, so hashes varies like the wall-clock figures and
+    runs compare on hashes_per_sec instead.
+    """
+
+    def __init__(self, size, seed=0, block_size=4, round_time=1.0, signer=None):
+        self.random = random.Random(seed)
+        self.round_time = round_time
+        self.events = deque()
+        self.hashes = 0
+        self.mining_time = 0.0
+        self.mined = set()
+        self.reorgs = 0
+        self.nodes = {}
+        for i in range(size):
+            node = SimNode(self, f'sim{i}')
+            self.nodes[node.name] = node
+
+        first = next(iter(self.nodes.values()))
+        self.now = first.chain[0]['timestamp']
+        for node in self.nodes.values():
+            if node is not first:
+                node.write(node.replace_chain, list(first.chain), 0)
+            node.nodes = set(self.nodes) - {node.name}
+            node.block_size = block_size
+            node.clock = lambda: self.now
+            if signer:
+                node.verifier.keys[str(signer[0])] = signer[1]
+        self.reorgs = 0
+
+    # The executor interface Blockchain.peer_pool and .resolver are used through
+    def submit(self, fn, *args):
+        self.events.append((fn, args))
+
+    def map(self, fn, items):
+        return list(map(fn, items))
+
+    def deliver(self):
+        """Run queued messages, and whatever they queue, until none are left"""
+        while self.events:
+            fn, args = self.events.popleft()
+            fn(*args)
+
+    def step(self, mine_probability):
+        """Advance one round: each node with pending votes finds a block with
+        mine_probability, then every resulting message is delivered"""
+        self.now += self.round_time
+        for node in self.nodes.values():
+            if node.pending_votes and self.random.random() < mine_probability:
+                node.mine()
+        self.deliver()
+
+
+def run_inprocess(args):
+    tp1, tp2 = TP1Server(args.workers), TP2Server(args.workers)
+    signer = (tp2.signerID, (tp2.public_key.n, tp2.public_key.e))
+    votes, stats = make_votes(ballots(args.voters, args.seed), tp1.encrypt_batch, tp2.sign_batch, tp2.signerID)
+
+    cluster = Cluster(args.nodes, args.seed, args.block_size, args.round_time, signer)
+    names = sorted(cluster.nodes)
+    mine_probability = args.mine_probability or 1 / len(names)
+    rng = random.Random(args.seed + 1)
+    arrivals = deque(votes)
+    outstanding = {}  # signed_hash -> (node, wall time submitted, round submitted)
+    latencies, round_latencies = [], []
+    ingested, ingest_time = 0, 0.0
+    rounds = 0
+    started = time.perf_counter()
+
+    while (arrivals or outstanding) and rounds < args.max_rounds:
+        rounds += 1
+        batches = {}
+        for _ in range(min(args.rate, len(arrivals))):
+            vote = arrivals.popleft()
+            targets = rng.sample(names, min(args.fanout, len(names)))
+            for name in targets:
+                batches.setdefault(name, []).append(vote)
+            outstanding[Mempool.key(vote)] = (targets[0], time.perf_counter(), rounds)
+        for name in names:
+            if name in batches:
+                t = time.perf_counter()
+                cluster.nodes[name].new_votes(batches[name])
+                ingest_time += time.perf_counter() - t
+                ingested += len(batches[name])
+
+        cluster.step(mine_probability)
+
+        now = time.perf_counter()
+        for key, (name, submitted, submitted_round) in list(outstanding.items()):
+            node = cluster.nodes[name]
+            index = node.find_vote(key)
+            if index is not None and len(node.chain) - index + 1 >= args.confirmations:
+                latencies.append(now - submitted)
+                round_latencies.append(rounds - submitted_round)
+                del outstanding[key]
+    wall_time = time.perf_counter() - started
+
+    reference = cluster.nodes[names[0]]
+    on_chain = {reference.block_hash(b) for b in reference.chain}
+    stale = len(cluster.mined - on_chain)
+    result = {
+        'votes': args.voters,
+        'confirmed': len(latencies),
+        'rounds': rounds,
+        'wall_time': wall_time,
+        'ingest_votes_per_sec': rate(ingested, ingest_time),
+        'hashes': cluster.hashes,
+        'hashes_per_sec': rate(cluster.hashes, cluster.mining_time),
+        'blocks_mined': len(cluster.mined),
+        'stale_blocks': stale,
+        'fork_rate': stale / len(cluster.mined) if cluster.mined else 0.0,
+        'reorgs': cluster.reorgs,
+        'converged': len({n.block_hash(n.last_block) for n in cluster.nodes.values()}) == 1,
+        'latency_seconds': percentiles(latencies),
+        'latency_rounds': percentiles(round_latencies),
+        'nodes': [{
+            'name': name,
+            'height': len(node.chain),
+            'work': node.total_work,
+            'pending': len(node.pending_votes),
+            'memory_bytes': deep_size(node.chain, node.pending_votes, node.vote_index,
+                                      node.hash_cache, node.chain_work),
+        } for name, node in sorted(cluster.nodes.items())],
+    }
+    result.update(stats)
+    return result
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Nothing listening on port {port} after {timeout} seconds')
+
+
+def framed_request(port, request):
+    with socket.create_connection(('127.0.0.1', port), timeout=300) as s:
+        send_message(s, request)
+        response = recv_message(s)
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response
+
+
+def resident_memory(pid):
+    """Resident set size of pid in bytes, None where /proc isn't available"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_loopback(args):
+    """Run TP1, TP2 and the nodes as real processes on loopback and drive them over HTTP"""
+    ports = [args.base_port + i for i in range(args.nodes)]
+    logs = tempfile.mkdtemp(prefix='bench-')
+    procs = {}
+
+    def spawn(name, command):
+        log = open(os.path.join(logs, f'{name}.log'), 'w')
+        # Own session, so teardown also reaches the process pools the servers fork
+        procs[name] = subprocess.Popen([sys.executable, '-u'] + command, cwd=HERE, stdout=log,
+                                       stderr=subprocess.STDOUT, start_new_session=True)
+
+    try:
+        key = os.path.join(logs, 'tp2_key.pem')
+        spawn('tp1', ['tp1.py'])
+        spawn('tp2', ['tp2.py', '--key', key])
+        wait_for_port(5002)  # TP2 has saved its key, which the nodes pin
+        signer_id = framed_request(5002, {'type': 'public_key'})['signerID']
+        for port in ports:
+            spawn(f'node{port}', ['pow.py', '--port', str(port), '--block-size', str(args.block_size),
+                                  '--max-wait', str(args.max_wait), '--workers', str(args.workers),
+                                  '--signer-key', f'{signer_id}={key}.pub'])
+        for port in [5001] + ports:
+            wait_for_port(port)
+        for port in ports:
+            others = [f'127.0.0.1:{p}' for p in ports if p != port]
+            requests.post(f'http://127.0.0.1:{port}/nodes/register', json={'nodes': others}, timeout=10)
+
+        encrypt = lambda messages: framed_request(5001, {'type': 'encrypt_votes', 'messages': messages})['encrypted_votes']
+        sign = lambda hashes: framed_request(5002, {'type': 'blind_sign_batch', 'hashes': hashes})['signatures']
+        votes, stats = make_votes(ballots(args.voters, args.seed), encrypt, sign, signer_id)
+
+        rng = random.Random(args.seed + 1)
+        session = requests.Session()
+        waiters = ThreadPoolExecutor(max_workers=64)
+        latencies, confirmations = [], []
+        ingested, ingest_time = 0, 0.0
+
+        def confirm(port, key, submitted):
+            response = requests.get(f'http://127.0.0.1:{port}/votes/{key}/wait',
+                                    params={'confirmations': args.confirmations, 'timeout': 60}, timeout=70)
+            if response.status_code == 200 and response.json()['confirmations'] >= args.confirmations:
+                latencies.append(time.perf_counter() - submitted)
+
+        started = time.perf_counter()
+        for offset in range(0, len(votes), args.rate):
+            tick = time.perf_counter()
+            batch = votes[offset:offset + args.rate]
+            batches, first = {}, []
+            for vote in batch:
+                targets = rng.sample(ports, min(args.fanout, len(ports)))
+                for port in targets:
+                    batches.setdefault(port, []).append(vote)
+                first.append(targets[0])
+            for port, port_votes in batches.items():
+                t = time.perf_counter()
+                session.post(f'http://127.0.0.1:{port}/vote/add/batch', json={'votes': port_votes}, timeout=60)
+                ingest_time += time.perf_counter() - t
+                ingested += len(port_votes)
+            submitted = time.perf_counter()
+            for vote, port in zip(batch, first):
+                confirmations.append(waiters.submit(confirm, port, Mempool.key(vote), submitted))
+            time.sleep(max(0, args.round_time - (time.perf_counter() - tick)))
+        for future in confirmations:
+            try:
+                future.result()
+            except requests.RequestException:
+                pass
+        wall_time = time.perf_counter() - started
+        waiters.shutdown()
+
+        response = session.get(f'http://127.0.0.1:{ports[0]}/blocks', params={'format': 'ndjson'}, timeout=60)
+        chain = [json.loads(line) for line in response.iter_lines() if line]
+        nodes = []
+        mined = 0
+        for port in ports:
+            state = session.post(f'http://127.0.0.1:{port}/blocks/locate', json={'locator': []}, timeout=10).json()
+            with open(os.path.join(logs, f'node{port}.log')) as f:
+                node_mined = sum(line.startswith('Mined block') for line in f)
+            mined += node_mined
+            nodes.append({
+                'name': f'127.0.0.1:{port}',
+                'height': state['length'],
+                'work': state['work'],
+                'mined': node_mined,
+                'memory_bytes': resident_memory(procs[f'node{port}'].pid),
+            })
+        hashes = sum(block['nonce'] + 1 for block in chain[1:])  # on-chain blocks only
+        stale = max(0, mined - (len(chain) - 1))
+        result = {
+            'votes': args.voters,
+            'confirmed': len(latencies),
+            'wall_time': wall_time,
+            'ingest_votes_per_sec': rate(ingested, ingest_time),
+            'hashes': hashes,
+            'hashes_per_sec': rate(hashes, wall_time),
+            'blocks_mined': mined,
+            'stale_blocks': stale,
+            'fork_rate': stale / mined if mined else 0.0,
+            'converged': len({n['work'] for n in nodes}) == 1,
+            'latency_seconds': percentiles(latencies),
+            'nodes': nodes,
+            'logs': logs,
+        }
+        result.update(stats)
+        return result
+    finally:
+        for proc in procs.values():
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for proc in procs.values():
+            proc.wait()
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Run a cluster under synthetic voting load and report JSON metrics')
+    parser.add_argument('--mode', choices=['inprocess', 'loopback'], default='inprocess',
+                        help='simulate the nodes in this process, or run them as processes on loopback')
+    parser.add_argument('-n', '--nodes', default=3, type=int, help='number of nodes')
+    parser.add_argument('-m', '--voters', default=200, type=int, help='number of synthetic voters')
+    parser.add_argument('-r', '--rate', default=20, type=int, help='votes submitted per round')
+    parser.add_argument('--fanout', default=2, type=int, help='nodes each vote is sent to')
+    parser.add_argument('-b', '--block-size', default=4, type=int, help='votes per block')
+    parser.add_argument('-c', '--confirmations', default=1, type=int, help='depth at which a vote counts as confirmed')
+    parser.add_argument('--round-time', default=1.0, type=float,
+                        help='seconds per round, virtual in process and real on loopback')
+    parser.add_argument('--mine-probability', default=None, type=float,
+                        help='chance a node finds a block in a round, in process (default 1/nodes)')
+    parser.add_argument('--max-rounds', default=10000, type=int, help='give up after this many rounds, in process')
+    parser.add_argument('--max-wait', default=2, type=float, help="nodes' --max-wait, on loopback")
+    parser.add_argument('--base-port', default=7001, type=int, help='port of the first node, on loopback')
+    parser.add_argument('-w', '--workers', default=1, type=int, help='worker processes for TP1, TP2 and mining')
+    parser.add_argument('-s', '--seed', default=0, type=int)
+    parser.add_argument('-o', '--output', default=None, help='append the result as a JSON line to this file')
+    args = parser.parse_args()
+
+    run = run_inprocess if args.mode == 'inprocess' else run_loopback
+    with contextlib.redirect_stdout(sys.stderr):  # keep the nodes' chatter out of the JSON
+        metrics = run(args)
+    result = {
+        'mode': args.mode,
+        'config': vars(args),
+        'commit': commit(),
+        'python': platform.python_version(),
+        'time': time.time(),
+    }
+    result.update(metrics)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
@@ -0,0 +1,60 @@
+from collections.abc import Sequence
+
+
+class ChainView(Sequence):
+    """An immutable view of the first length items of a list, plus a tail.
+
+    The list underneath is only ever appended to, so a view never sees
+    anything past its own length and stays valid however the list grows.
+    append() therefore costs O(1) when the view ends where the list does,
+    which is always the case for the chain writer extending its own tip.
+    Only one thread may append to views of the same list.
+
+    spliced() puts other blocks after a prefix without copying the prefix,
+    so a candidate chain can be validated against ours in O(new blocks).
+    Slicing returns a plain list.
+    """
+
+    __slots__ = ('items', 'length', 'tail')
+
+    def __init__(self, items=None, length=None, tail=()):
+        self.items = [] if items is None else items
+        self.length = len(self.items) if length is None else length
+        self.tail = tail
+
+    def __len__(self):
+        return self.length + len(self.tail)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('chain index out of range')
+        if position < self.length:
+            return self.items[position]
+        return self.tail[position - self.length]
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self.items[i]
+        yield from self.tail
+
+    def __add__(self, other):
+        return self.spliced(len(self), other)
+
+    def append(self, item):
+        """A view one item longer"""
+        if self.tail or len(self.items) != self.length:
+            items = list(self)  # a spliced view, or one the list has grown past: copy once
+        else:
+            items = self.items
+        items.append(item)
+        return ChainView(items, len(items))
+
+    def spliced(self, fork, items):
+        """A view of our first fork items followed by items"""
+        if fork <= self.length:
+            return ChainView(self.items, fork, list(items))
+        return ChainView(self.items, self.length, list(self.tail[:fork - self.length]) + list(items))
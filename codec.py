@@ -0,0 +1,227 @@
+import hashlib
+import json
+import struct
+
+# Block format versions. Version 1 blocks are plain dicts whose canonical form
+# is their sorted-key JSON; versions 2 and 3 are encoded as
+#
+#   HEADER | vote count (u32) | votes
+#
+# where each vote is VOTE_HEAD followed by the raw ciphertext and the
+# big-endian signature bytes. The header commits to the votes through
+# votes_root and ends with the nonce, so it alone is the hashing preimage.
+# Version 2 takes votes_root as one digest over all votes, version 3 as the
+# root of a Merkle tree over them, so single votes can be proven. Version 4
+# adds the block's difficulty to the header, just before the nonce; earlier
+# versions were all mined at DEFAULT_DIFFICULTY.
+JSON_VERSION = 1
+BINARY_VERSION = 2
+MERKLE_VERSION = 3
+DIFFICULTY_VERSION = 4
+VERSIONS = (JSON_VERSION, BINARY_VERSION, MERKLE_VERSION, DIFFICULTY_VERSION)
+
+HEADER = struct.Struct('>BQd32s32sQ')  # version, index, timestamp, previous_hash, votes_root, nonce
+DIFFICULTY_HEADER = struct.Struct('>BQd32s32sQQ')  # as HEADER, with difficulty before the nonce
+VOTE_HEAD = struct.Struct('>IHH')  # signer_id, ciphertext length, signature length
+MAX_VOTE_FIELD = 0xFFFF  # bytes of ciphertext or signature VOTE_HEAD can describe
+COUNT = struct.Struct('>I')
+VOTE_FIELDS = {'signer_id', 'encrypted_vote', 'signed_hash'}
+
+# Expected number of hashes per block; a hash meets it when it is below
+# 2**256 // difficulty, so 2**16 is the old "0000" hex prefix check
+DEFAULT_DIFFICULTY = 1 << 16
+# Retargeting never goes below this, so a chain can't be forged for nothing
+MIN_DIFFICULTY = 1 << 12
+# Blocks between difficulty adjustments, which scale it by at most RETARGET_CLAMP
+RETARGET_WINDOW = 16
+RETARGET_CLAMP = 4
+
+# Wire format for a sequence of encoded blocks, each prefixed by COUNT
+BLOCKS_MIMETYPE = 'application/vnd.thesis.blocks'
+
+
+def block_json(block):
+    return json.dumps(block, sort_keys=True).encode()
+
+
+def encode_vote(vote):
+    if set(vote) != VOTE_FIELDS:
+        raise ValueError('Vote has unexpected fields')
+    ciphertext = bytes.fromhex(vote['encrypted_vote'])
+    signed_hash = vote['signed_hash']
+    signature = signed_hash.to_bytes((signed_hash.bit_length() + 7) // 8, 'big')
+    return VOTE_HEAD.pack(vote['signer_id'], len(ciphertext), len(signature)) + ciphertext + signature
+
+
+def decode_vote(data, offset):
+    """(vote, offset just past it)"""
+    signer_id, ciphertext_size, signature_size = VOTE_HEAD.unpack_from(data, offset)
+    offset += VOTE_HEAD.size
+    ciphertext = data[offset:offset + ciphertext_size]
+    offset += ciphertext_size
+    signature = data[offset:offset + signature_size]
+    offset += signature_size
+    vote = {
+        'signer_id': signer_id,
+        'encrypted_vote': bytes(ciphertext).hex(),
+        'signed_hash': int.from_bytes(signature, 'big'),
+    }
+    return vote, offset
+
+
+def merkle_leaf(vote):
+    # Leaves and inner nodes are domain-separated so neither can pose as the other
+    return hashlib.sha256(b'\x00' + encode_vote(vote)).digest()
+
+
+def _merkle_parent(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _merkle_levels(leaves):
+    """Every level of the tree, leaves first; an odd last node moves up as is"""
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [_merkle_parent(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(leaves):
+    if not leaves:
+        return hashlib.sha256(b'').digest()
+    return _merkle_levels(leaves)[-1][0]
+
+
+def merkle_proof(leaves, position):
+    """Sibling path from leaf position to the root as [side, hex] pairs,
+    side telling whether the sibling sits to the 'L'eft or 'R'ight"""
+    proof = []
+    for level in _merkle_levels(leaves)[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append(['L' if sibling < position else 'R', level[sibling].hex()])
+        position //= 2
+    return proof
+
+
+def verify_merkle_proof(leaf, proof, root):
+    node = leaf
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        node = _merkle_parent(sibling, node) if side == 'L' else _merkle_parent(node, sibling)
+    return node.hex() == root
+
+
+def votes_root(votes, version=MERKLE_VERSION):
+    """Hex digest committing to the votes of a binary block"""
+    if version == BINARY_VERSION:
+        return hashlib.sha256(b''.join(encode_vote(vote) for vote in votes)).hexdigest()
+    return merkle_root([merkle_leaf(vote) for vote in votes]).hex()
+
+
+def difficulty(block):
+    if block.get('version', JSON_VERSION) < DIFFICULTY_VERSION:
+        return DEFAULT_DIFFICULTY
+    return block['difficulty']
+
+
+def target(block):
+    """Block hashes must be below this, read as big-endian integers"""
+    return (1 << 256) // difficulty(block)
+
+
+def block_header(block):
+    """The block without its votes; version 1 blocks have no header and come whole"""
+    if block.get('version', JSON_VERSION) == JSON_VERSION:
+        return block
+    return {key: value for key, value in block.items() if key != 'votes'}
+
+
+def header(block):
+    fields = (
+        block['version'],
+        block['index'],
+        block['timestamp'],
+        bytes.fromhex(block['previous_hash']),
+        bytes.fromhex(block['votes_root']),
+    )
+    if block['version'] >= DIFFICULTY_VERSION:
+        return DIFFICULTY_HEADER.pack(*fields, block['difficulty'], block['nonce'])
+    return HEADER.pack(*fields, block['nonce'])
+
+
+def preimage(block):
+    """Bytes whose SHA-256 is the block hash"""
+    if block.get('version', JSON_VERSION) == JSON_VERSION:
+        return block_json(block)
+    return header(block)
+
+
+def encode_block(block):
+    """Compact encoding of block; version 1 blocks stay canonical JSON.
+
+    JSON always starts with '{', which is no valid version byte, so the two
+    can share a log or a stream.
+    """
+    if block.get('version', JSON_VERSION) == JSON_VERSION:
+        return block_json(block)
+    votes = block['votes']
+    return b''.join([header(block), COUNT.pack(len(votes))] + [encode_vote(vote) for vote in votes])
+
+
+def decode_block(data):
+    if data[:1] == b'{':
+        return json.loads(data)
+    (version,) = struct.unpack_from('>B', data)
+    if version == JSON_VERSION or version not in VERSIONS:
+        raise ValueError(f'Unknown block version {version}')
+    if version >= DIFFICULTY_VERSION:
+        version, index, timestamp, previous_hash, root, difficulty, nonce = DIFFICULTY_HEADER.unpack_from(data)
+        offset = DIFFICULTY_HEADER.size
+    else:
+        version, index, timestamp, previous_hash, root, nonce = HEADER.unpack_from(data)
+        offset = HEADER.size
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    votes = []
+    for _ in range(count):
+        vote, offset = decode_vote(data, offset)
+        votes.append(vote)
+    block = {
+        'version': version,
+        'index': index,
+        'timestamp': timestamp,
+        'votes': votes,
+        'nonce': nonce,
+        'previous_hash': previous_hash.hex(),
+        'votes_root': root.hex(),
+    }
+    if version >= DIFFICULTY_VERSION:
+        block['difficulty'] = difficulty
+    return block
+
+
+def encode_blocks(blocks):
+    """Frame encoded blocks for BLOCKS_MIMETYPE, one at a time"""
+    for block in blocks:
+        data = encode_block(block)
+        yield COUNT.pack(len(data)) + data
+
+
+def decode_blocks(chunks):
+    """Blocks from a BLOCKS_MIMETYPE body arriving as arbitrary chunks"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= COUNT.size:
+            (size,) = COUNT.unpack_from(buffer)
+            if len(buffer) < COUNT.size + size:
+                break
+            yield decode_block(bytes(buffer[COUNT.size:COUNT.size + size]))
+            del buffer[:COUNT.size + size]
+    if buffer:
+        raise ValueError('Truncated block stream')
@@ -0,0 +1,98 @@
+import json
+import socket
+import socketserver
+import struct
+
+# Every message is a 4-byte big-endian length followed by that many bytes of JSON
+HEADER = struct.Struct('>I')
+MAX_MESSAGE = 64 * 1024 * 1024
+
+
+def send_message(sock, message):
+    payload = json.dumps(message).encode()
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            if data:
+                raise ConnectionError("Connection closed mid-message")
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def recv_payload(sock):
+    """Raw JSON bytes of the next message, or None once the peer has closed"""
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ValueError(f"Message of {size} bytes is too large")
+    return _recv_exact(sock, size) or b''
+
+
+def recv_message(sock):
+    payload = recv_payload(sock)
+    if payload is None:
+        raise ConnectionError("Connection closed")
+    return json.loads(payload)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        # A bare '{' can't start a frame (it'd announce a >2 GB message), so it
+        # marks an old client that sends one unframed JSON object per connection
+        if sock.recv(1, socket.MSG_PEEK) == b'{':
+            self.handle_unframed(sock)
+            return
+
+        while True:
+            try:
+                data = recv_payload(sock)
+            except (ConnectionError, ValueError):
+                return
+            if data is None:
+                return
+            send_message(sock, self.server.respond(data))
+
+    def handle_unframed(self, sock):
+        data = b''
+        while len(data) < MAX_MESSAGE:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+            try:
+                json.loads(data)
+                break
+            except ValueError:
+                continue
+        sock.sendall(json.dumps(self.server.respond(data)).encode())
+
+
+class FramedServer(socketserver.ThreadingTCPServer):
+    """Thread-per-connection server speaking length-prefixed JSON.
+
+    Connections stay open for any number of request/response pairs.
+    handle_request gets each request as a JSON string and returns a dict.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, handle_request):
+        self.handle_request = handle_request
+        super().__init__(address, _Handler)
+
+    def respond(self, data):
+        try:
+            return self.handle_request(data.decode())
+        except Exception as e:
+            return {"error": str(e)}
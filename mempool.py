@@ -0,0 +1,110 @@
+import itertools
+import threading
+from collections import deque
+from time import monotonic
+
+import codec
+
+
+class Mempool:
+    """FIFO of pending votes with O(1) duplicate rejection and removal.
+
+    Votes are keyed by signed_hash; a vote whose key is already queued is
+    refused, so the same vote relayed by several peers is only mined once.
+    Each vote is also findable by its Merkle leaf, which is how compact block
+    announcements refer to votes.
+
+    Removal only forgets the key; the stale queue entry is skipped and dropped
+    once it reaches the front, so evicting k votes costs O(k).
+
+    Safe to share between the request threads that add votes and the
+    chain writer and miner that peek at and evict them.
+    """
+
+    def __init__(self, votes=()):
+        self.votes = deque()  # (sequence, vote), possibly stale
+        self.keys = {}  # signed_hash -> (sequence, leaf hex, monotonic time queued)
+        self.leaves = {}  # leaf hex -> vote
+        self.signers = {}  # str(signer_id) -> votes queued
+        self.sequence = itertools.count()
+        self.lock = threading.RLock()
+        for vote in votes:
+            self.add(vote)
+
+    @staticmethod
+    def key(vote):
+        return str(vote['signed_hash'])
+
+    def add(self, vote):
+        """Queue vote, return False if it is already queued"""
+        key = self.key(vote)
+        leaf = codec.merkle_leaf(vote).hex()
+        with self.lock:
+            if key in self.keys:
+                return False
+            sequence = next(self.sequence)
+            self.keys[key] = (sequence, leaf, monotonic())
+            self.leaves[leaf] = vote
+            signer = str(vote.get('signer_id'))
+            self.signers[signer] = self.signers.get(signer, 0) + 1
+            self.votes.append((sequence, vote))
+        return True
+
+    def _live(self, entry):
+        sequence, vote = entry
+        queued = self.keys.get(self.key(vote))
+        return queued is not None and queued[0] == sequence
+
+    def peek(self, count):
+        votes = []
+        with self.lock:
+            for entry in self.votes:
+                if len(votes) >= count:
+                    break
+                if self._live(entry):
+                    votes.append(entry[1])
+        return votes
+
+    def remove(self, key):
+        with self.lock:
+            queued = self.keys.pop(key, None)
+            if queued is not None:
+                signer = str(self.leaves.pop(queued[1]).get('signer_id'))
+                self.signers[signer] -= 1
+                if not self.signers[signer]:
+                    del self.signers[signer]
+        return queued is not None
+
+    def evict(self, keys):
+        """Drop queued votes whose key is in keys, e.g. votes a block already holds"""
+        with self.lock:
+            evicted = sum(self.remove(key) for key in keys)
+            if len(self.votes) > 2 * len(self.keys) + 1024:
+                self.votes = deque(entry for entry in self.votes if self._live(entry))
+        return evicted
+
+    def oldest(self):
+        """Monotonic time the vote at the front was queued, None if empty"""
+        with self.lock:
+            while self.votes and not self._live(self.votes[0]):
+                self.votes.popleft()
+            if not self.votes:
+                return None
+            return self.keys[self.key(self.votes[0][1])][2]
+
+    def pending_from(self, signer):
+        """Votes queued for str(signer_id) signer"""
+        return self.signers.get(signer, 0)
+
+    def by_leaf(self, leaf):
+        return self.leaves.get(leaf)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __iter__(self):
+        with self.lock:
+            return iter([entry[1] for entry in self.votes if self._live(entry)])
+
+    def __len__(self):
+        return len(self.keys)
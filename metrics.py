@@ -0,0 +1,198 @@
+import cProfile
+import io
+import pstats
+import random
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Metric:
+    """One metric family; each distinct set of labels gets its own series"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.series = {}  # sorted label items -> value
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self.lock:
+            series = sorted(self.series.items())
+        return self.header() + [f'{self.name}{_labels(k)} {v}' for k, v in series]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that is set, or read from function at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.series.get(key)
+            if counts is None:
+                counts = self.series[key] = [0] * len(self.buckets) + [0, 0]  # buckets, +Inf, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes; it gets labels back to fill in what it learns"""
+        started = perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def render(self):
+        with self.lock:
+            series = sorted((k, list(v)) for k, v in self.series.items())
+        lines = self.header()
+        for key, counts in series:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(key, [("le", bound)])} {count}')
+            lines.append(f'{self.name}_bucket{_labels(key, [("le", "+Inf")])} {counts[-2]}')
+            lines.append(f'{self.name}_count{_labels(key)} {counts[-2]}')
+            lines.append(f'{self.name}_sum{_labels(key)} {counts[-1]}')
+        return lines
+
+
+class Registry:
+    """Metrics of one node, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation, function=None):
+        return self.register(Gauge(name, documentation, function))
+
+    def histogram(self, name, documentation, buckets=BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+class NodeMetrics(Registry):
+    """The measurements a pow.py node exports on /metrics"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = self.counter('node_http_requests_total', 'HTTP requests served, by endpoint and status')
+        self.request_seconds = self.histogram('node_http_request_seconds', 'Time to handle an HTTP request')
+        self.resolve_seconds = self.histogram('node_resolve_conflicts_seconds',
+                                              'Time spent in resolve_conflicts, by outcome')
+        self.valid_chain_seconds = self.histogram('node_valid_chain_seconds', 'Time spent in valid_chain, by result')
+        self.mining_hashes = self.counter('node_mining_hashes_total', 'Nonces tried by searches that found a block')
+        self.mining_seconds = self.counter('node_mining_seconds_total', 'Time spent in searches that found a block')
+        self.hash_rate = self.gauge('node_mining_hashes_per_second', 'Hash rate of the last successful search')
+        self.peer_fetch_seconds = self.histogram('node_peer_fetch_seconds', 'Time to fetch a chain from a peer')
+        self.peer_fetch_failures = self.counter('node_peer_fetch_failures_total', 'Chain fetches that failed, by peer')
+
+
+class RequestProfiler:
+    """cProfile a random fraction of requests and pool the results.
+
+    rate can be changed at any time; at 0 (the default) nothing is profiled
+    and start() costs a single comparison.
+    """
+
+    def __init__(self, rate=0.0):
+        self.rate = rate
+        self.stats = None
+        self.profiled = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        """A running profiler if this request is sampled, else None"""
+        if not self.rate or random.random() >= self.rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active on this interpreter
+            return None
+        return profiler
+
+    def stop(self, profiler):
+        profiler.disable()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+            self.profiled += 1
+
+    def reset(self):
+        with self.lock:
+            self.stats = None
+            self.profiled = 0
+
+    def report(self, sort='cumulative', limit=40):
+        """The pooled profile as pstats text, the top limit functions by sort"""
+        out = io.StringIO()
+        with self.lock:
+            out.write(f'{self.profiled} requests profiled at rate {self.rate}\n')
+            if self.stats is not None:
+                self.stats.stream = out
+                self.stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
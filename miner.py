@@ -0,0 +1,127 @@
+import hashlib
+import json
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import codec
+
+DEFAULT_TARGET = 1 << (256 - 16)  # equivalent of the "0000" hex prefix check
+
+
+def block_preimage(block):
+    """Canonical bytes that Blockchain.hash digests"""
+    return codec.preimage(block)
+
+
+def split_preimage(block):
+    """Split the canonical encoding around the nonce, return (prefix, suffix, width).
+
+    Binary headers end in a fixed-width nonce, so the suffix is empty. For
+    JSON blocks the nonce is written as decimal digits (width None); keys are
+    sorted, so the top-level "nonce" is the first one after "index" and always
+    precedes the votes, and the first match is the one we want.
+    """
+    encoded = block_preimage(block)
+    if block.get('version', codec.JSON_VERSION) != codec.JSON_VERSION:
+        return encoded[:-8], b'', 8
+    key = b'"nonce": '
+    start = encoded.index(key + json.dumps(block['nonce']).encode()) + len(key)
+    end = start + len(json.dumps(block['nonce']))
+    return encoded[:start], encoded[end:], None
+
+
+def meets_target(digest, target=DEFAULT_TARGET):
+    return int.from_bytes(digest, 'big') < target
+
+
+def search(prefix, suffix, start, stop, target=DEFAULT_TARGET, width=None):
+    """Try nonces in [start, stop), return (nonce, hexdigest) or None.
+
+    The nonce is spliced in as width big-endian bytes, or as decimal digits
+    when width is None.
+    """
+    head = hashlib.sha256(prefix)
+    if width:
+        for nonce in range(start, stop):
+            h = head.copy()
+            h.update(nonce.to_bytes(width, 'big'))
+            if int.from_bytes(h.digest(), 'big') < target:
+                return nonce, h.hexdigest()
+        return None
+    for nonce in range(start, stop):
+        h = head.copy()
+        h.update(b'%d' % nonce)
+        h.update(suffix)
+        if int.from_bytes(h.digest(), 'big') < target:
+            return nonce, h.hexdigest()
+    return None
+
+
+_stop = None
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = stop
+
+
+def _scan(prefix, suffix, width, start, stride, chunk, target, stop=None):
+    """Search [start, start + chunk), then jump by stride, until found or stopped"""
+    stop = stop or _stop
+    while not stop.is_set():
+        found = search(prefix, suffix, start, start + chunk, target, width)
+        if found:
+            return found
+        start += stride
+    return None
+
+
+class Miner:
+    """Nonce search over a block, optionally split across a process pool.
+
+    With N workers, worker i scans chunks i, i + N, i + 2N, ... of the nonce
+    space starting at block['nonce']. The first worker to find a valid nonce
+    wins and the rest are stopped through a shared event, which cancel()
+    also sets so a running search can be abandoned from another thread.
+    """
+
+    def __init__(self, workers=1, chunk=1 << 14):
+        self.workers = workers
+        self.chunk = chunk
+        self._stop = multiprocessing.Event()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def cancel(self):
+        self._stop.set()
+
+    def mine(self, block, target=DEFAULT_TARGET):
+        """Return (nonce, hexdigest) for block, or None if cancelled"""
+        prefix, suffix, width = split_preimage(block)
+        start = block['nonce']
+        with self._lock:
+            self._stop.clear()
+            if self.workers <= 1:
+                return _scan(prefix, suffix, width, start, self.chunk, self.chunk, target, self._stop)
+
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self._stop,))
+            stride = self.chunk * self.workers
+            pending = {
+                self._pool.submit(_scan, prefix, suffix, width, start + i * self.chunk, stride, self.chunk, target)
+                for i in range(self.workers)
+            }
+            result = None
+            while pending and not result:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                result = next((f.result() for f in done if f.result()), None)
+            # Stop the losers and let them drain before the next search clears the flag
+            self._stop.set()
+            wait(pending)
+            return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
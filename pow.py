@@ -1,39 +1,296 @@
 import hashlib
+import itertools
 import json
-from time import time
+import queue
+import struct
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import perf_counter, time
 from urllib.parse import urlparse
 from uuid import uuid4
 
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
+
+import codec
+import miner
+from chainview import ChainView
+from mempool import Mempool
+from metrics import NodeMetrics, RequestProfiler
+from scheduler import BlockScheduler
+from store import ChainStore
+from verifier import SignatureVerifier
+
+
+# What readers see of the chain: the blocks and the cumulative work up to each,
+# as ChainViews, and how many votes each signer_id has on it. None of them
+# changes once published; the writer publishes new ones.
+Snapshot = namedtuple('Snapshot', ['chain', 'work', 'signers'])
 
 
 class Blockchain:
-    def __init__(self):
-        self.pending_votes = []
-        self.chain = []
+    """A node's chain and mempool.
+
+    All changes to the chain go through write(), which runs them one at a
+    time on a single writer thread; validation and mining happen before,
+    on the caller's thread, so the writer only ever rechecks the tip and
+    applies. Readers take self.snapshot (or self.chain) once and keep a
+    consistent view without locking, however the chain moves on meanwhile.
+    """
+
+    def __init__(self, workers=1):
+        self.miner = miner.Miner(workers)
+        self.pending_votes = Mempool()
+        self.block_size = 4  # votes per block
+        self.block_version = codec.DIFFICULTY_VERSION
+        self.block_interval = 10  # seconds between blocks that retargeting aims for
+        self.retarget_window = codec.RETARGET_WINDOW  # blocks between difficulty adjustments
+        self.clock = time  # block timestamps; a simulation can swap in a virtual clock
+        self.max_clock_drift = 120  # seconds a peer's block may be stamped ahead of our clock
+        self.snapshot = Snapshot(ChainView(), ChainView(), {})
+        # Votes each signer_id may have on the chain, None for no limit. A signer_id names
+        # a TP2 signing key, not a voter, so this caps what one TP2 can put on the chain.
+        self.signer_quota = None
+        self.hash_cache = {}  # (index, timestamp, nonce) -> (block, hash)
+        self.vote_index = {}  # signed_hash or vote digest -> block index
+        self.chain_changed = threading.Condition()
+        self.writes = queue.Queue()
+        self.writer = threading.Thread(target=self._apply_writes, name='chain-writer', daemon=True)
+        self.writer.start()
         # self.nodes = set()
         self.nodes = {"127.0.0.1:6003", "127.0.0.1:6002", "127.0.0.1:6001"}
-        self.new_block(previous_hash='1', nonce=100)
+        self.sessions = {}
+        self.peer_pool = ThreadPoolExecutor(max_workers=32)
+        # Background resolves get their own thread: they block on peer_pool.map,
+        # so running them on peer_pool itself could leave no worker for the fetches
+        self.resolver = ThreadPoolExecutor(max_workers=1)
+        self.resolve_queued = False
+        self.resolve_lock = threading.Lock()
+        self.peer_timeout = 5
+        self.store = None
+        self.port = None  # advertised in block announcements so peers can fetch votes back
+        self.verifier = SignatureVerifier({33: ("127.0.0.1", 5002)})
+        self.scheduler = BlockScheduler(self)  # started by __main__
+        self.metrics = NodeMetrics()
+        self.metrics.gauge('node_mempool_votes', 'Votes waiting to be mined', lambda: len(self.pending_votes))
+        self.metrics.gauge('node_chain_height', 'Blocks on our chain', lambda: len(self.chain))
+        self.metrics.gauge('node_chain_work', 'Cumulative difficulty of our chain', lambda: self.total_work)
+        self.new_block(previous_hash='0' * 64, nonce=100)
+
+    def attach_store(self, store):
+        """Persist to store from now on, resuming from its chain if it has one"""
+        self.store = store
+        blocks, hashes = store.load()
+        if blocks:
+            self.snapshot = Snapshot(ChainView(blocks),
+                                     ChainView(list(itertools.accumulate(codec.difficulty(b) for b in blocks))),
+                                     self.load_signer_counts(store, blocks, hashes))
+            self.hash_cache = {self.cache_key(b): (b, h) for b, h in zip(blocks, hashes)}
+            self.vote_index = {}
+            self.index_votes(blocks)
+            self.notify_chain_changed()
+            self.pending_votes = Mempool(v for v in store.load_votes() if self.find_vote(Mempool.key(v)) is None)
+            print(f"Loaded {len(blocks)} blocks and {len(self.pending_votes)} pending votes from {store.directory}")
+        else:
+            self.persist_chain(0)
+            store.write_votes(self.pending_votes)
+
+    @staticmethod
+    def load_signer_counts(store, blocks, hashes):
+        """Votes per signer on the stored chain, from the saved counts if they still match it"""
+        saved = store.load_signer_counts()
+        if saved and 0 < saved['height'] <= len(blocks) and hashes[saved['height'] - 1] == saved['block_hash']:
+            return Blockchain.count_signers(saved['counts'], blocks[saved['height']:])
+        return Blockchain.count_signers({}, blocks)
+
+    def persist_chain(self, fork):
+        """Rewrite the stored chain after its first fork blocks"""
+        if self.store:
+            self.store.truncate(fork)
+            chain = self.chain
+            for block in chain[fork:]:
+                self.store.append(block, self.block_hash(block))
+            self.store.write_signer_counts(len(chain), self.block_hash(chain[-1]), self.snapshot.signers)
+
+    @property
+    def chain(self):
+        return self.snapshot.chain
+
+    @property
+    def chain_work(self):
+        return self.snapshot.work
+
+    def write(self, fn, *args):
+        """Run fn(*args) on the writer thread and return what it returns"""
+        if threading.current_thread() is self.writer:
+            return fn(*args)
+        future = Future()
+        self.writes.put((fn, args, future))
+        return future.result()
+
+    def _apply_writes(self):
+        while True:
+            fn, args, future = self.writes.get()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def extend_tip(self, block, block_hash):
+        """Writer: append block if it still builds on our tip, return whether it did"""
+        chain = self.chain
+        if chain and (block['index'] != len(chain) + 1 or block['previous_hash'] != self.block_hash(chain[-1])):
+            return False
+        self.add_block(block, block_hash)
+        return True
+
+    def pick_votes(self, signers):
+        """Up to block_size pending votes that keep each signer within signer_quota on top of signers.
+
+        A vote that doesn't fit can never be mined on this chain, so it is
+        dropped from the mempool rather than left to hold up later blocks.
+        """
+        votes = self.pending_votes.peek(self.block_size)
+        if self.signer_quota is None:
+            return votes
+        counts, picked = dict(signers), []
+        for vote in votes:
+            signer = str(vote.get('signer_id'))
+            counts[signer] = counts.get(signer, 0) + 1
+            if counts[signer] > self.signer_quota:
+                self.pending_votes.remove(Mempool.key(vote))
+                if self.store:
+                    self.store.remove_votes([Mempool.key(vote)], self.pending_votes)
+                print(f"Dropped vote {Mempool.key(vote)[:16]}..., signer {signer} is over its quota")
+            else:
+                picked.append(vote)
+        return picked
 
     def new_block(self, nonce, previous_hash):
+        chain, _, signers = self.snapshot
         block = {
-            'index': len(self.chain) + 1,
-            'timestamp': time(),
-            'votes': self.pending_votes[:4], #first 4 votes
+            'index': len(chain) + 1,
+            # Never at or before the parent, even if our clock is behind the peer that mined it
+            'timestamp': max(self.clock(), chain[-1]['timestamp'] + 0.001) if chain else self.clock(),
+            'votes': self.pick_votes(signers),
             'nonce': nonce,
-            'previous_hash': self.hash(self.chain[-1]) if self.chain else previous_hash,
+            'previous_hash': self.block_hash(chain[-1]) if chain else previous_hash,
         }
+        if self.block_version != codec.JSON_VERSION:
+            block['version'] = self.block_version
+            block['votes_root'] = codec.votes_root(block['votes'], self.block_version)
+        if self.block_version >= codec.DIFFICULTY_VERSION:
+            block['difficulty'] = self.next_difficulty(chain, len(chain))
 
-        block_hash=self.hash(block)
-        while block_hash[:4] != "0000":
-            block['nonce'] += 1
-            block_hash = self.hash(block)
-
-        self.pending_votes = self.pending_votes[4:]  # Remove the first 4 votes
-        self.chain.append(block)
+        started = perf_counter()
+        found = self.miner.mine(block, codec.target(block))
+        if found is None:
+            return None
+        hashes = found[0] - block['nonce'] + 1  # approximate with several workers
+        elapsed = perf_counter() - started
+        self.metrics.mining_hashes.inc(hashes)
+        self.metrics.mining_seconds.inc(elapsed)
+        if elapsed > 0:
+            self.metrics.hash_rate.set(hashes / elapsed)
+        block['nonce'], block_hash = found
+        if not self.write(self.extend_tip, block, block_hash):
+            return None  # the tip moved while we were mining
+        if block['index'] > 1:
+            self.announce_block(block)
         return block
+
+    def add_block(self, block, block_hash):
+        """Writer: append a mined or validated block on top of our tip"""
+        self.hash_cache[self.cache_key(block)] = (block, block_hash)
+        chain, work, signers = self.snapshot
+        # Readers keep the old views, which never see past their own length
+        self.snapshot = Snapshot(chain.append(block), work.append((work[-1] if work else 0) + codec.difficulty(block)),
+                                 self.count_signers(signers, [block]))
+        self.index_votes([block])
+        keys = [Mempool.key(vote) for vote in block['votes'] if 'signed_hash' in vote]
+        self.pending_votes.evict(keys)
+        if self.store:
+            self.store.append(block, block_hash)
+            self.store.write_signer_counts(block['index'], block_hash, self.snapshot.signers)
+            self.store.remove_votes(keys, self.pending_votes)
+        self.notify_chain_changed()
     
+    @property
+    def total_work(self):
+        return self.chain_work[-1] if self.chain_work else 0
+
+    def work(self, chain, fork):
+        """Cumulative work of chain, which shares its first fork blocks with ours"""
+        return (self.chain_work[fork - 1] if fork else 0) + sum(codec.difficulty(b) for b in chain[fork:])
+
+    @staticmethod
+    def count_signers(counts, blocks, sign=1):
+        """counts with the votes of blocks added per signer_id (removed for sign=-1), as a new dict"""
+        counts = dict(counts)
+        for block in blocks:
+            for vote in block['votes']:
+                signer = str(vote.get('signer_id'))
+                counts[signer] = counts.get(signer, 0) + sign
+                if not counts[signer]:
+                    del counts[signer]
+        return counts
+
+    def signer_counts(self, chain, start):
+        """Votes per signer in chain[:start], taken from our index when that is a prefix of our chain"""
+        ours, _, signers = self.snapshot
+        if 0 < start <= len(ours) and self.block_hash(ours[start - 1]) == self.block_hash(chain[start - 1]):
+            return self.count_signers(signers, ours[start:], -1)
+        return self.count_signers({}, chain[:start])
+
+    def repeated_vote(self, chain, start):
+        """Index of the first block of chain[start:] with a vote already earlier in chain, or None.
+
+        Votes in chain[:start] are looked up in our index when that is a prefix of our chain.
+        """
+        ours = self.chain
+        if 0 < start <= len(ours) and self.block_hash(ours[start - 1]) == self.block_hash(chain[start - 1]):
+            def earlier(key):
+                index = self.find_vote(key)
+                return index is not None and index <= start
+        else:
+            earlier = {Mempool.key(vote) for block in chain[:start] for vote in block['votes']
+                       if 'signed_hash' in vote}.__contains__
+        seen = set()
+        for block in chain[start:]:
+            for vote in block['votes']:
+                if 'signed_hash' not in vote:
+                    continue
+                key = Mempool.key(vote)
+                if key in seen or earlier(key):
+                    return block['index']
+                seen.add(key)
+        return None
+
+    def next_difficulty(self, chain, position):
+        """Difficulty the block at chain[position] must carry.
+
+        Every retarget_window blocks, the parent's difficulty is scaled by how
+        much faster or slower than block_interval the blocks since the last
+        adjustment came, by at most RETARGET_CLAMP either way and never below
+        MIN_DIFFICULTY. Blocks after a pre-difficulty block, and the genesis
+        block, start at the default.
+        """
+        if position == 0:
+            return codec.DEFAULT_DIFFICULTY
+        parent = chain[position - 1]
+        if parent.get('version', codec.JSON_VERSION) < codec.DIFFICULTY_VERSION:
+            return codec.DEFAULT_DIFFICULTY
+        difficulty = parent['difficulty']
+        if position % self.retarget_window or not self.block_interval:
+            return difficulty
+
+        first = max(position - 1 - self.retarget_window, 0)
+        expected = (position - 1 - first) * self.block_interval
+        clamp = codec.RETARGET_CLAMP
+        actual = min(max(parent['timestamp'] - chain[first]['timestamp'], expected / clamp), expected * clamp)
+        return max(codec.MIN_DIFFICULTY, int(difficulty * expected / actual))
+
     def register_node(self, address):
         parsed_url = urlparse(address)
         if parsed_url.netloc:
@@ -43,86 +300,530 @@ class Blockchain:
         else:
             raise ValueError('Invalid URL')
 
-    def valid_chain(self, chain):
-        last_block = chain[0]
-        current_index = 1
+    def valid_chain(self, chain, start=1):
+        """Check links and proofs from chain[start] onwards; earlier blocks are trusted.
+
+        With start=0 the chain must also begin with our genesis block or with
+        one that could have been mined as a genesis block.
+        """
+        with self.metrics.valid_chain_seconds.time(result='error') as labels:
+            valid = self._valid_chain(chain, start)
+            labels['result'] = 'valid' if valid else 'invalid'
+        return valid
+
+    def _valid_chain(self, chain, start):
+        if start == 0:
+            if not chain or not self.valid_genesis(chain[0]):
+                print("Invalid genesis block")
+                return False
+            start = 1
+        last_block = chain[start - 1]
+        current_index = start
 
         while current_index < len(chain):
             block = chain[current_index]
-            last_block_hash = self.hash(last_block)
+            if block.get('version', codec.JSON_VERSION) not in codec.VERSIONS:
+                print(f"Unknown version at block {current_index}")
+                return False
+            if block['index'] != current_index + 1:
+                print(f"Invalid index at block {current_index}")
+                return False
+            last_block_hash = self.block_hash(last_block)
 
             if block['previous_hash'] != last_block_hash:
                 print(f"Invalid previous hash at block {current_index}")
                 return False
-            if self.hash(block)[:4] != "0000":
+            if codec.difficulty(block) != self.next_difficulty(chain, current_index):
+                print(f"Invalid difficulty at block {current_index}")
+                return False
+            if int(self.block_hash(block), 16) >= codec.target(block):
                 print(f"Invalid proof of work at block {current_index}")
                 return False
-            if block['timestamp'] <= last_block['timestamp']:
+            if not last_block['timestamp'] < block['timestamp'] <= self.clock() + self.max_clock_drift:
                 print(f"Invalid timestamp at block {current_index}")
                 return False
+            if block.get('version', codec.JSON_VERSION) != codec.JSON_VERSION and not self.valid_votes_root(block):
+                print(f"Invalid votes root at block {current_index}")
+                return False
             
             last_block = block
             current_index += 1
-        print("\nValid chain at node {self.nodes}\n")
+
+        if self.signer_quota is not None:
+            counts = self.signer_counts(chain, start)
+            for block in chain[start:]:
+                for vote in block['votes']:
+                    signer = str(vote.get('signer_id'))
+                    counts[signer] = counts.get(signer, 0) + 1
+                    if counts[signer] > self.signer_quota:
+                        print(f"Signer {signer} over its quota in block {block['index']}")
+                        return False
+
+        index = self.repeated_vote(chain, start)
+        if index is not None:
+            print(f"Duplicate vote in block {index}")
+            return False
+
+        votes = [(block['index'], vote) for block in chain[start:] for vote in block['votes']]
+        errors = self.verifier.verify([vote for _, vote in votes])
+        for (index, _), error in zip(votes, errors):
+            if error:
+                print(f"{error} in block {index}")
+                return False
+        print(f"\nValid chain at node {self.nodes}\n")
         return True
 
+    def valid_genesis(self, block):
+        """Whether block is our genesis, or a well-formed one of a peer: first,
+        voteless, mined at the default difficulty on the all-zero parent"""
+        ours = self.chain
+        if ours and block == ours[0]:
+            return True
+        version = block.get('version', codec.JSON_VERSION)
+        if version not in codec.VERSIONS or block['index'] != 1 or block['previous_hash'] != '0' * 64:
+            return False
+        if block['votes'] != [] or codec.difficulty(block) != codec.DEFAULT_DIFFICULTY:
+            return False
+        if version != codec.JSON_VERSION and not self.valid_votes_root(block):
+            return False
+        return int(self.block_hash(block), 16) < codec.target(block)
+
+    @staticmethod
+    def valid_votes_root(block):
+        try:
+            return block['votes_root'] == codec.votes_root(block['votes'], block['version'])
+        except (ValueError, TypeError, KeyError, AttributeError, OverflowError, struct.error):
+            return False
+
+    def session(self, node):
+        """Keep-alive HTTP session for a peer, created on first use"""
+        if node not in self.sessions:
+            self.sessions[node] = requests.Session()
+        return self.sessions[node]
+
+    def fetch_chain(self, node, locator, min_work):
+        """Our chain with the peer's blocks after the fork point spliced in.
+
+        Returns None when the peer is unreachable, misbehaves, or its chain
+        carries no more than min_work.
+        """
+        session = self.session(node)
+        started = perf_counter()
+        try:
+            response = session.post(f'http://{node}/blocks/locate', json={'locator': locator},
+                                    timeout=self.peer_timeout)
+            if response.status_code != 200:
+                return None
+            located = response.json()
+            if located['work'] <= min_work:
+                return None
+
+            fork = located['fork']
+            chain = self.chain
+            if not isinstance(fork, int) or not 0 <= fork <= len(chain):
+                print(f"Skipping node {node}: fork {fork!r} is off our chain")
+                return None
+            response = session.get(f'http://{node}/blocks', params={'start': fork + 1},
+                                   headers={'Accept': f'{codec.BLOCKS_MIMETYPE}, application/x-ndjson;q=0.5'},
+                                   timeout=self.peer_timeout, stream=True)
+            if response.status_code != 200:
+                return None
+            if response.headers.get('Content-Type', '').startswith(codec.BLOCKS_MIMETYPE):
+                blocks = list(codec.decode_blocks(response.iter_content(1 << 16)))
+            else:
+                blocks = [json.loads(line) for line in response.iter_lines() if line]
+            return fork, chain.spliced(fork, blocks)
+        except (requests.RequestException, ValueError, KeyError, TypeError, struct.error) as e:
+            self.metrics.peer_fetch_failures.inc(peer=node)
+            print(f"Skipping node {node}: {e}")
+            return None
+        finally:
+            self.metrics.peer_fetch_seconds.observe(perf_counter() - started, peer=node)
+
+    def request_resolve(self):
+        """Resolve in the background; requests made while one is waiting to start join it"""
+        with self.resolve_lock:
+            if self.resolve_queued:
+                return
+            self.resolve_queued = True
+        self.resolver.submit(self._background_resolve)
+
+    def _background_resolve(self):
+        with self.resolve_lock:
+            self.resolve_queued = False
+        try:
+            self.resolve_conflicts()
+        except Exception as e:
+            print(f"Background resolve failed: {e}")
+
     def resolve_conflicts(self):
-        neighbours = self.nodes
+        with self.metrics.resolve_seconds.time(outcome='error') as labels:
+            replaced = self._resolve_conflicts()
+            labels['outcome'] = 'replaced' if replaced else 'kept'
+        return replaced
+
+    def _resolve_conflicts(self):
+        neighbours = list(self.nodes)
         new_chain = None
+        new_fork = 0
 
-        max_length = len(self.chain)
+        max_work = self.total_work
         print(neighbours)
-        for node in neighbours:
-            response = requests.get(f'http://{node}/chain')
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
+        locator = self.block_locator()
+        fetched = self.peer_pool.map(lambda node: self.fetch_chain(node, locator, max_work), neighbours)
+        candidates = []
+        for fork, chain in filter(None, fetched):
+            try:
+                candidates.append((self.work(chain, fork), fork, chain))
+            except (ValueError, TypeError, KeyError, AttributeError):
+                print(f"Skipping a chain with malformed difficulty after block {fork}")
+        candidates.sort(key=lambda c: c[0], reverse=True)
 
-                if length > max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
+        # Most work wins, not most blocks: a few blocks at high difficulty outweigh many cheap ones.
+        # The claimed work only counts once every block it comes from is validated,
+        # the genesis included when the peer shares none of our blocks.
+        for work, fork, chain in candidates:
+            if work <= max_work:
+                break
+            try:
+                valid = self.valid_chain(chain, start=fork)
+            except (ValueError, TypeError, KeyError, AttributeError, ZeroDivisionError, struct.error):
+                valid = False
+            if valid:
+                max_work = work
+                new_chain, new_fork = chain, fork
+                break
+            self.forget_hashes(chain[fork:])
 
         if new_chain:
-            self.chain = new_chain
+            if not self.write(self.swap_chain, new_chain, new_fork, max_work):
+                self.forget_hashes(new_chain[new_fork:])
+                return False  # our chain gained more work or moved while we were fetching
+            self.announce_block(new_chain[-1])
             return True
-
         return False
 
-    def new_vote(self, vote):
-        # Validate vote structure
+    def swap_chain(self, chain, fork, work):
+        """Writer: replace_chain if chain still has more work and still forks from ours at fork"""
+        ours = self.chain
+        if work <= self.total_work or fork > len(ours):
+            return False
+        if fork and self.block_hash(ours[fork - 1]) != self.block_hash(chain[fork - 1]):
+            return False
+        self.replace_chain(chain, fork)
+        return True
+
+    def replace_chain(self, chain, fork):
+        """Writer: swap in chain, which shares its first fork blocks with ours"""
+        self.miner.cancel()
+        old = self.snapshot
+        orphaned = old.chain[fork:]
+        self.unindex_votes(orphaned)
+        total, tail = old.work[fork - 1] if fork else 0, []
+        for block in chain[fork:]:
+            total += codec.difficulty(block)
+            tail.append(total)
+        signers = self.count_signers(self.count_signers(old.signers, orphaned, -1), chain[fork:])
+        if not isinstance(chain, ChainView):
+            chain = ChainView(list(chain))
+        self.snapshot = Snapshot(chain, old.work.spliced(fork, tail), signers)
+        self.index_votes(chain[fork:])
+        self.forget_hashes(orphaned)
+
+        # Votes the new blocks hold leave the mempool; votes only our dropped blocks held go back in
+        keys = [Mempool.key(vote) for block in chain[fork:] for vote in block['votes'] if 'signed_hash' in vote]
+        self.pending_votes.evict(keys)
+        restored = [vote for block in orphaned for vote in block['votes']
+                    if 'signed_hash' in vote and self.find_vote(Mempool.key(vote)) is None
+                    and self.pending_votes.add(vote)]
+
+        self.persist_chain(fork)
+        if self.store:
+            self.store.remove_votes(keys, self.pending_votes)
+            self.store.append_votes(restored)
+        self.notify_chain_changed()
+        self.scheduler.nudge()
+
+    def compact_block(self, block):
+        """Announcement for block: its header and the Merkle leaf of each vote.
+
+        Blocks without a Merkle root can't be rebuilt from leaves and are
+        announced whole.
+        """
+        if block.get('version', codec.JSON_VERSION) < codec.MERKLE_VERSION:
+            return {'block': block}
+        return {
+            'header': codec.block_header(block),
+            'leaves': [codec.merkle_leaf(vote).hex() for vote in block['votes']],
+        }
+
+    def announce_block(self, block):
+        """Push block to every peer in the background"""
+        message = self.compact_block(block)
+        message['port'] = self.port
+        message['work'] = self.total_work
+        for node in list(self.nodes):
+            self.peer_pool.submit(self.send_announcement, node, message)
+
+    def send_announcement(self, node, message):
+        try:
+            self.session(node).post(f'http://{node}/blocks/announce', json=message, timeout=self.peer_timeout)
+        except requests.RequestException as e:
+            print(f"Couldn't announce block to {node}: {e}")
+
+    def fetch_votes(self, origin, index, positions):
+        """Votes at positions of block index on the announcing peer"""
+        response = self.session(origin).post(f'http://{origin}/blocks/votes',
+                                             json={'index': index, 'positions': positions},
+                                             timeout=self.peer_timeout)
+        response.raise_for_status()
+        return response.json()['votes']
+
+    def receive_block(self, message, origin=None):
+        """Handle a peer's block announcement.
+
+        A block that extends our tip is rebuilt from our mempool, fetching only
+        the votes we lack from origin, then validated, appended and relayed.
+        An announcement from a peer whose chain carries more work than ours,
+        but that we can't attach to directly, starts a resolve in the
+        background. Returns 'accepted', 'known', 'syncing' or 'rejected'.
+        """
+        header = message['block'] if 'block' in message else message['header']
+        chain = self.chain
+        try:
+            index = header['index']
+            known = 1 <= index <= len(chain) and self.block_hash(chain[index - 1]) == self.hash(header)
+        except (ValueError, TypeError, KeyError, AttributeError, struct.error):
+            return 'rejected'
+        if known:
+            return 'known'
+        if index != len(chain) + 1 or header['previous_hash'] != self.block_hash(chain[-1]):
+            if not isinstance(message.get('work'), int) or message['work'] <= self.total_work:
+                return 'rejected'
+            self.request_resolve()
+            return 'syncing'
+
+        if 'block' in message:
+            block = message['block']
+        else:
+            votes = [self.pending_votes.by_leaf(leaf) for leaf in message['leaves']]
+            missing = [position for position, vote in enumerate(votes) if vote is None]
+            if missing:
+                if origin is None:
+                    return 'rejected'
+                try:
+                    for position, vote in zip(missing, self.fetch_votes(origin, index, missing)):
+                        votes[position] = vote
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    print(f"Couldn't fetch votes of block {index} from {origin}: {e}")
+                    return 'rejected'
+            block = dict(header, votes=votes)
+
+        chain = self.chain  # the writer rechecks the tip before appending
+        if index != len(chain) + 1:
+            return 'rejected'
+        try:
+            valid = self.valid_chain(chain + [block], start=len(chain))
+        except (ValueError, TypeError, KeyError, AttributeError, struct.error):
+            valid = False
+        if not valid or not self.write(self.extend_tip, block, self.block_hash(block)):
+            self.forget_hashes([block])
+            return 'rejected'
+        self.miner.cancel()
+        self.announce_block(block)
+        return 'accepted'
+
+    def block_locator(self):
+        """[index, hash] pairs from the tip back to genesis, spaced one apart
+        for the last ten blocks and doubling after that"""
+        chain = self.chain
+        locator = []
+        position, step = len(chain) - 1, 1
+        while position > 0:
+            block = chain[position]
+            locator.append([block['index'], self.block_hash(block)])
+            if len(locator) >= 10:
+                step *= 2
+            position -= step
+        locator.append([chain[0]['index'], self.block_hash(chain[0])])
+        return locator
+
+    def find_fork(self, locator):
+        """Index of the newest locator entry that is also on our chain, 0 if none"""
+        chain = self.chain
+        for index, block_hash in locator:
+            if 1 <= index <= len(chain) and self.block_hash(chain[index - 1]) == block_hash:
+                return index
+        return 0
+
+    def check_vote(self, vote):
+        """Raise ValueError if vote is malformed or already known"""
         # required_fields = ['vote_id', 'encrypted_vote', 'signed_hash']
         required_fields = ['signer_id', 'encrypted_vote', 'signed_hash']
-        if not all(field in vote for field in required_fields):
+        if not isinstance(vote, dict) or set(vote) != set(required_fields):
             raise ValueError('Invalid vote format')
-        
-        self.pending_votes.append(vote)
+        if not (isinstance(vote['signer_id'], int) and 0 <= vote['signer_id'] < 1 << 32
+                and isinstance(vote['encrypted_vote'], str) and isinstance(vote['signed_hash'], int)):
+            raise ValueError('Invalid vote format')
+        try:
+            ciphertext = bytes.fromhex(vote['encrypted_vote'])
+        except ValueError:
+            raise ValueError('Invalid vote format')
+        if vote['signed_hash'] < 0:
+            raise ValueError('Invalid vote format')
+        if len(ciphertext) > codec.MAX_VOTE_FIELD or vote['signed_hash'].bit_length() > 8 * codec.MAX_VOTE_FIELD:
+            raise ValueError('Vote too large to encode')
+        key = Mempool.key(vote)
+        if self.find_vote(key) is not None or key in self.pending_votes:
+            raise ValueError('Duplicate vote')
+        if self.signer_quota is not None:
+            signer = str(vote['signer_id'])
+            if self.snapshot.signers.get(signer, 0) + self.pending_votes.pending_from(signer) >= self.signer_quota:
+                raise ValueError('Signer quota reached')
+
+    def new_vote(self, vote):
+        result = self.new_votes([vote])[0]
+        if result['status'] != 'received':
+            raise ValueError(result['message'])
         return self.last_block['index'] + 1
 
+    def new_votes(self, votes):
+        """Admit a batch of votes in one pass, return a status for each.
+
+        Cheap format and duplicate checks run first, then the signatures of
+        the survivors are verified together before they enter the mempool.
+        """
+        results = [None] * len(votes)
+        candidates = []
+        for position, vote in enumerate(votes):
+            try:
+                self.check_vote(vote)
+                candidates.append(position)
+            except ValueError as e:
+                results[position] = {'status': 'error', 'message': str(e)}
+
+        accepted = []
+        errors = self.verifier.verify([votes[position] for position in candidates])
+        for position, error in zip(candidates, errors):
+            if error is None and not self.pending_votes.add(votes[position]):
+                error = 'Duplicate vote'
+            elif error is None and self.find_vote(Mempool.key(votes[position])) is not None:
+                # a block holding it landed since check_vote, after the writer evicted its votes
+                self.pending_votes.remove(Mempool.key(votes[position]))
+                error = 'Duplicate vote'
+            if error:
+                results[position] = {'status': 'error', 'message': error}
+                continue
+            accepted.append(votes[position])
+            results[position] = {'status': 'received'}
+        if self.store and accepted:
+            self.store.append_votes(accepted)
+        if accepted:
+            self.scheduler.nudge()
+        return results
+
+    @staticmethod
+    def vote_digest(vote):
+        return hashlib.sha256(json.dumps(vote, sort_keys=True).encode()).hexdigest()
+
+    def index_votes(self, blocks):
+        for block in blocks:
+            for vote in block['votes']:
+                if 'signed_hash' in vote:
+                    self.vote_index[str(vote['signed_hash'])] = block['index']
+                self.vote_index[self.vote_digest(vote)] = block['index']
+
+    def unindex_votes(self, blocks):
+        for block in blocks:
+            for vote in block['votes']:
+                if 'signed_hash' in vote:
+                    self.vote_index.pop(str(vote['signed_hash']), None)
+                self.vote_index.pop(self.vote_digest(vote), None)
+
+    def vote_proof(self, key):
+        """Merkle proof that the vote with this signed_hash or digest is in our chain.
+
+        Returns the block header, the vote's position and the sibling path,
+        or None if the vote isn't on the chain or its block predates Merkle roots.
+        """
+        chain = self.chain
+        index = self.find_vote(key)
+        if index is None or index > len(chain):
+            return None
+        block = chain[index - 1]
+        if block.get('version', codec.JSON_VERSION) < codec.MERKLE_VERSION:
+            return None
+        votes = block['votes']
+        position = next(i for i, vote in enumerate(votes)
+                        if Mempool.key(vote) == key or self.vote_digest(vote) == key)
+        return {
+            'header': codec.block_header(block),
+            'position': position,
+            'proof': codec.merkle_proof([codec.merkle_leaf(vote) for vote in votes], position),
+        }
+
+    def find_vote(self, key):
+        """Index of the block holding the vote with this signed_hash or digest"""
+        return self.vote_index.get(key)
+
+    def notify_chain_changed(self):
+        with self.chain_changed:
+            self.chain_changed.notify_all()
+
+    def wait_for_vote(self, key, confirmations=1, timeout=30):
+        """Block until the vote is confirmations deep or timeout expires.
+
+        Returns the index of the block holding the vote, or None if it is
+        still not on our chain.
+        """
+        deadline = time() + timeout
+        with self.chain_changed:
+            while True:
+                index = self.find_vote(key)
+                if index is not None and len(self.chain) - index + 1 >= confirmations:
+                    return index
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return index
+                self.chain_changed.wait(remaining)
+
     @property
     def last_block(self):
         return self.chain[-1]
 
     @staticmethod
-    def hash(block):
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+    def cache_key(block):
+        return block['index'], block['timestamp'], block['nonce']
 
-    #unneded
-    def proof_of_work(self, last_block):
-        last_nonce = last_block['nonce']
-        last_hash = self.hash(last_block)
+    def block_hash(self, block):
+        """Hash of block, computed once and then served from hash_cache.
 
-        nonce = 0
-        while not self.valid_proof(last_nonce, nonce, last_hash):
-            nonce += 1
+        Entries are keyed by index and header fields, and only reused when the
+        cached block is this very block or equal to it in content, so a peer
+        block that differs from ours in any field is always rehashed.
+        """
+        key = self.cache_key(block)
+        cached = self.hash_cache.get(key)
+        if cached and (cached[0] is block or cached[0] == block):
+            return cached[1]
+        block_hash = self.hash(block)
+        self.hash_cache[key] = (block, block_hash)
+        return block_hash
 
-        return nonce
+    def forget_hashes(self, blocks):
+        """Drop the cached hashes of blocks that didn't make it onto our chain, or left it"""
+        for block in blocks:
+            try:
+                key = self.cache_key(block)
+                cached = self.hash_cache.get(key)
+            except (TypeError, KeyError, AttributeError):
+                continue  # malformed, so never cached
+            if cached is not None and cached[0] is block:
+                self.hash_cache.pop(key, None)
 
-    @staticmethod #unneded
-    def valid_proof(last_nonce, nonce, last_hash):
-        guess = f'{last_nonce}{nonce}{last_hash}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:4] == "0000"
+    @staticmethod
+    def hash(block):
+        return hashlib.sha256(miner.block_preimage(block)).hexdigest()
 
 
 app = Flask(__name__)
@@ -130,29 +831,38 @@ app = Flask(__name__)
 node_identifier = str(uuid4()).replace('-', '')
 
 blockchain = Blockchain()
+profiler = RequestProfiler()
+
+
+@app.before_request
+def start_request():
+    g.started = perf_counter()
+    g.profile = profiler.start()
+
+
+@app.after_request
+def finish_request(response):
+    if g.get('profile') is not None:
+        profiler.stop(g.profile)
+    endpoint = request.endpoint or 'unknown'
+    blockchain.metrics.requests.inc(endpoint=endpoint, status=response.status_code)
+    blockchain.metrics.request_seconds.observe(perf_counter() - g.started, endpoint=endpoint)
+    return response
 
 
 @app.route('/mine', methods=['GET'])
 def mine():
-    if len(blockchain.pending_votes) < 4:
-        return jsonify({'message': 'Not enough votes to mine'}), 400
-    
-    last_block = blockchain.last_block
-    nonce = blockchain.proof_of_work(last_block)
-
-    previous_hash = blockchain.hash(last_block)
-    block = blockchain.new_block(nonce, previous_hash)#pow needs complete overhaul
+    pending = len(blockchain.pending_votes)
+    if not pending:
+        return jsonify({'message': 'No votes to mine'}), 400
 
+    blockchain.scheduler.trigger()
     response = {
-        'message': "New Block Forged",
-        'index': block['index'],
-        'timestamp': block['timestamp'],
-        'votes': len(block['votes']),
-        'nonce': block['nonce'],
-        'previous_hash': block['previous_hash'][:7],
-        'hash': blockchain.hash(block)[:7],
+        'message': 'Mining scheduled',
+        'pending': pending,
+        'index': blockchain.last_block['index'] + 1,
     }
-    return jsonify(response), 200
+    return jsonify(response), 202
 
 
 @app.route('/vote/new', methods=['POST'])
@@ -191,19 +901,215 @@ def add_vote():
         return jsonify({'status': 'error', 'message': str(e)}), 407
 
 
+@app.route('/vote/add/batch', methods=['POST'])
+def add_votes():
+    values = request.get_json(silent=True)
+    votes = values.get('votes') if isinstance(values, dict) else None
+    if not isinstance(votes, list):
+        return jsonify({'status': 'error', 'message': 'No votes provided'}), 406
+
+    results = blockchain.new_votes(votes)
+    response = {
+        'accepted': sum(result['status'] == 'received' for result in results),
+        'results': results,
+        'index': blockchain.last_block['index'] + 1,
+    }
+    return jsonify(response), 201
+
+
+@app.route('/votes/<key>', methods=['GET'])
+def find_vote(key):
+    index = blockchain.find_vote(key)
+    if index is None:
+        return jsonify({'message': 'Vote not in chain'}), 404
+
+    response = {
+        'block': index,
+        'confirmations': len(blockchain.chain) - index + 1,
+    }
+    return jsonify(response), 200
+
+
+@app.route('/votes/<key>/wait', methods=['GET'])
+def wait_for_vote(key):
+    confirmations = request.args.get('confirmations', 1, type=int)
+    timeout = min(request.args.get('timeout', 30, type=float), 60)
+    index = blockchain.wait_for_vote(key, confirmations, timeout)
+    if index is None:
+        return jsonify({'message': 'Vote not in chain'}), 404
+
+    response = {
+        'block': index,
+        'confirmations': len(blockchain.chain) - index + 1,
+    }
+    return jsonify(response), 200
+
+
+def chain_etag(chain):
+    return f'"{blockchain.block_hash(chain[-1])}-{len(chain)}"'
+
+
+def stream_blocks(chain, start, end, key, extra, etag):
+    """Encode chain[start:end] lazily, one block at a time.
+
+    The format follows the client's Accept header (or ?format=): binary
+    framed blocks for codec.BLOCKS_MIMETYPE, NDJSON for application/x-ndjson,
+    otherwise a JSON object with the blocks under key plus the extra fields.
+    Answers 304 when If-None-Match already names this tip in this format;
+    the format is part of the ETag and Vary tells caches it follows Accept.
+    """
+    wanted = request.args.get('format') or request.accept_mimetypes.best
+    if wanted in ('binary', codec.BLOCKS_MIMETYPE):
+        form, mimetype = 'binary', codec.BLOCKS_MIMETYPE
+    elif wanted in ('ndjson', 'application/x-ndjson'):
+        form, mimetype = 'ndjson', 'application/x-ndjson'
+    else:
+        form, mimetype = 'json', 'application/json'
+
+    etag = f'{etag[:-1]}-{form}"'
+    headers = {'ETag': etag, 'Vary': 'Accept'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+
+    if mimetype == codec.BLOCKS_MIMETYPE:
+        body = codec.encode_blocks(chain[i] for i in range(start, end))
+        return Response(body, mimetype=mimetype, headers=headers)
+    if mimetype == 'application/x-ndjson':
+        body = (codec.block_json(chain[i]) + b'\n' for i in range(start, end))
+        return Response(body, mimetype=mimetype, headers=headers)
+
+    def body():
+        yield f'{{"{key}": ['.encode()
+        for i in range(start, end):
+            yield (b', ' if i > start else b'') + codec.block_json(chain[i])
+        yield b'], ' + json.dumps(extra, sort_keys=True)[1:].encode()  # extra's fields, minus its '{'
+
+    return Response(body(), mimetype='application/json', headers=headers)
+
+
+@app.route('/votes/<key>/proof', methods=['GET'])
+def vote_proof(key):
+    proof = blockchain.vote_proof(key)
+    if proof is None:
+        return jsonify({'message': 'No inclusion proof for this vote'}), 404
+    return jsonify(proof), 200
+
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    chain = blockchain.chain
+    length = len(chain)
+    return stream_blocks(chain, 0, length, 'chain', {'length': length}, chain_etag(chain))
+
+
+@app.route('/blocks', methods=['GET'])
+def blocks_range():
+    chain = blockchain.chain
+    length = len(chain)
+    start = request.args.get('start', 1, type=int)
+    end = request.args.get('end', length, type=int)
+    limit = request.args.get('limit', None, type=int)
+    if start < 1 or end < start - 1 or (limit is not None and limit < 1):
+        return jsonify({'message': 'Invalid block range'}), 400
+
+    end = min(end, length)
+    extra = {'length': length}
+    if limit is not None and end - start + 1 > limit:
+        end = start + limit - 1
+        extra['next'] = end + 1
+    return stream_blocks(chain, start - 1, end, 'blocks', extra, chain_etag(chain))
+
+
+@app.route('/headers', methods=['GET'])
+def headers_range():
+    chain = blockchain.chain
+    length = len(chain)
+    start = request.args.get('start', 1, type=int)
+    end = min(request.args.get('end', length, type=int), length)
+    limit = min(request.args.get('limit', 2000, type=int), 2000)
+    if start < 1 or end < start - 1 or limit < 1:
+        return jsonify({'message': 'Invalid block range'}), 400
+
+    response = {'length': length}
+    if end - start + 1 > limit:
+        end = start + limit - 1
+        response['next'] = end + 1
+    response['headers'] = [codec.block_header(chain[i]) for i in range(start - 1, end)]
+    return jsonify(response), 200
+
+
+@app.route('/blocks/announce', methods=['POST'])
+def announce_block():
+    values = request.get_json(silent=True)
+    if not isinstance(values, dict) or not ('block' in values or 'header' in values and 'leaves' in values):
+        return jsonify({'message': 'Please supply a block or compact block'}), 400
+
+    origin = f"{request.remote_addr}:{values['port']}" if values.get('port') else None
+    status = blockchain.receive_block(values, origin)
+    return jsonify({'status': status}), 200
+
+
+@app.route('/blocks/votes', methods=['POST'])
+def block_votes():
+    values = request.get_json(silent=True) or {}
+    index, positions = values.get('index'), values.get('positions')
+    chain = blockchain.chain
+    if not isinstance(index, int) or not 1 <= index <= len(chain) or not isinstance(positions, list):
+        return jsonify({'message': 'Please supply a block index and vote positions'}), 400
+
+    votes = chain[index - 1]['votes']
+    if not all(isinstance(p, int) and 0 <= p < len(votes) for p in positions):
+        return jsonify({'message': 'Invalid vote positions'}), 400
+    return jsonify({'votes': [votes[p] for p in positions]}), 200
+
+
+@app.route('/blocks/locate', methods=['POST'])
+def locate_fork():
+    values = request.get_json()
+    locator = values.get('locator') if values else None
+    if locator is None:
+        return jsonify({'message': 'Please supply a block locator'}), 400
+
+    chain, work, _ = blockchain.snapshot
     response = {
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain),
+        'fork': blockchain.find_fork(locator),
+        'length': len(chain),
+        'work': work[-1] if work else 0,
     }
     return jsonify(response), 200
 
 
 @app.route('/get_blockchain', methods=['GET', 'POST'])
 def get_blockchain():
-    chain_data = blockchain.chain
-    return jsonify({"blockchain": json.dumps(chain_data)}), 200
+    chain = blockchain.chain
+    length = len(chain)
+    return stream_blocks(chain, 0, length, 'blockchain', {'length': length}, chain_etag(chain))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(blockchain.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/debug/profile', methods=['GET', 'POST'])
+def profile():
+    if request.method == 'POST':
+        values = request.get_json(silent=True) or {}
+        rate = values.get('rate', profiler.rate)
+        if not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+            return jsonify({'message': 'rate must be between 0 and 1'}), 400
+        profiler.rate = rate
+        if values.get('reset'):
+            profiler.reset()
+        return jsonify({'rate': profiler.rate, 'profiled': profiler.profiled}), 200
+
+    sort = request.args.get('sort', 'cumulative')
+    limit = request.args.get('limit', 40, type=int)
+    try:
+        report = profiler.report(sort, limit)
+    except KeyError:
+        return jsonify({'message': f'Unknown sort key {sort}'}), 400
+    return Response(report, mimetype='text/plain')
 
 
 @app.route('/nodes/register', methods=['POST'])
@@ -226,18 +1132,21 @@ def register_nodes():
 @app.route('/nodes/resolve', methods=['GET'])
 def consensus():
     replaced = blockchain.resolve_conflicts()
+    chain, work, _ = blockchain.snapshot
 
     if replaced:
         response = {
             'message': 'Our chain was replaced',
-            'new_chain length': len(blockchain.chain),
-            'time': blockchain.chain[-1]['timestamp'],
+            'new_chain length': len(chain),
+            'work': work[-1],
+            'time': chain[-1]['timestamp'],
         }
     else:
         response = {
             'message': 'Our chain is authoritative',
-            'chain length': len(blockchain.chain),
-            'time': blockchain.chain[-1]['timestamp'],
+            'chain length': len(chain),
+            'work': work[-1],
+            'time': chain[-1]['timestamp'],
         }
 
     return jsonify(response), 200
@@ -248,40 +1157,49 @@ if __name__ == '__main__':
 
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', default=6001, type=int, help='port to listen on')
+    parser.add_argument('-w', '--workers', default=1, type=int, help='mining processes')
+    parser.add_argument('-b', '--block-size', default=4, type=int, help='votes per block')
+    parser.add_argument('-i', '--block-interval', default=10, type=float,
+                        help='seconds between blocks that difficulty retargets toward, 0 to keep it fixed; '
+                             'must match across nodes')
+    parser.add_argument('--retarget-window', default=codec.RETARGET_WINDOW, type=int,
+                        help='blocks between difficulty adjustments; must match across nodes')
+    parser.add_argument('--signer-quota', default=None, type=int,
+                        help='votes each TP2 signer_id may have on the chain in total, across all its voters '
+                             '(default: no limit); must match across nodes')
+    parser.add_argument('--min-votes', default=None, type=int,
+                        help='pending votes that start a block (default: block size)')
+    parser.add_argument('--max-wait', default=30, type=float,
+                        help='seconds a pending vote may wait before a partial block is mined, 0 to never')
+    parser.add_argument('--profile-rate', default=0, type=float,
+                        help='fraction of requests to cProfile, see /debug/profile')
+    parser.add_argument('-d', '--data-dir', default=None, help='directory to persist the chain in')
+    parser.add_argument('-s', '--signer', action='append', default=[],
+                        help='TP2 signer as ID=HOST:PORT, may be repeated (default 33=127.0.0.1:5002)')
+    parser.add_argument('--signer-key', action='append', default=[],
+                        help="TP2 signer's public key as ID=PEM file, trusted instead of the key its port returns; "
+                             'may be repeated')
     args = parser.parse_args()
     port = args.port
+    blockchain.port = port
+    blockchain.miner.workers = args.workers
+    blockchain.block_size = args.block_size
+    blockchain.block_interval = args.block_interval
+    blockchain.retarget_window = args.retarget_window
+    blockchain.signer_quota = args.signer_quota
+    blockchain.scheduler.min_votes = args.min_votes
+    blockchain.scheduler.max_wait = args.max_wait
+    profiler.rate = args.profile_rate
+    for signer in args.signer:
+        signer_id, _, address = signer.partition('=')
+        host, _, signer_port = address.rpartition(':')
+        blockchain.verifier.signers[signer_id] = (host, int(signer_port))
+    for signer in args.signer_key:
+        signer_id, _, path = signer.partition('=')
+        blockchain.verifier.pin_key(signer_id, path)
+    if args.data_dir:
+        blockchain.attach_store(ChainStore(args.data_dir))
 
-    app.run(host='0.0.0.0', port=port)
+    blockchain.scheduler.start()
 
-    # blockchain.nodes={"127.0.0.1:6001","127.0.0.1:6002","127.0.0.1:6003","127.0.0.1:6004"}
-    # while blockchain.chain == []:
-    #     print("Waiting for the genesis block...")
-    #     time.sleep(1)
-    
-    # while True:
-    #     while len(blockchain.pending_votes)>=4:
-    #         print("Mining...")
-    #         last_block = blockchain.last_block
-    #         nonce = blockchain.proof_of_work(last_block)
-
-    #         previous_hash = blockchain.hash(last_block)
-    #         block = blockchain.new_block(nonce, previous_hash)#pow needs complete overhaul
-
-    #         response = {
-    #             'message': "New Block Forged",
-    #             'index': block['index'],
-    #             'timestamp': block['timestamp'],
-    #             'votes': block['votes'][:7],
-    #             'nonce': block['nonce'],
-    #             'previous_hash': block['previous_hash'][:7],
-    #             'hash': blockchain.hash(block)[:7],
-    #         }
-    #         print(response)
-    #         time.sleep(5)
-
-    #         try:
-    #             print("Resolving conflicts...")
-    #             blockchain.resolve_conflicts()
-    #         except Exception as e:
-    #             print(f"Error resolving conflicts: {e}")
-    #         time.sleep(10)
+    app.run(host='0.0.0.0', port=port)
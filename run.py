@@ -27,7 +27,7 @@ def print_blockchain_periodically(miner_address, interval=5):
                 response = json.loads(s.recv(4096).decode())
                 if "blockchain" in response:
                     print("\n=== Current Blockchain ===")
-                    for block in json.loads(response["blockchain"]):
+                    for block in response["blockchain"]:
                         print(f"Block {block['index']}:")
                         print(f"  Hash: {block['hash']}")
                         print(f"  Previous Hash: {block['previous_hash']}")
@@ -84,7 +84,7 @@ def run_system():
         *[["python", "voter.py", "--voter", str(i), "--candidate", "Candidate" + ("A" if i%2 else "B")] 
           for i in range(1, 13)],
 
-        ['bash', 'mine&resolve.sh']
+        ['bash', 'mine&resolve.sh'],
 
         *[["python", "voter.py", "--voter", str(i), "--candidate", "Candidate" + ("A" if i%2 else "B")] 
           for i in range(13, 19)],
@@ -0,0 +1,80 @@
+import threading
+from time import monotonic
+
+
+class BlockScheduler:
+    """Mines blocks on a background thread instead of the request threads.
+
+    A block is started once min_votes votes are pending, or once the oldest
+    pending vote has waited max_wait seconds, or when trigger() is called.
+    When a peer's block or a resolve replaces our tip mid-search, new_block
+    gives up and the loop simply starts over on the new tip.
+    """
+
+    def __init__(self, blockchain, min_votes=None, max_wait=30):
+        self.blockchain = blockchain
+        self.min_votes = min_votes  # None follows blockchain.block_size
+        self.max_wait = max_wait  # seconds, 0 or None to only mine full blocks
+        self.wakeup = threading.Event()
+        self.triggered = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='block-scheduler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.blockchain.miner.cancel()
+        self.nudge()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def nudge(self):
+        """Re-evaluate now, e.g. because votes arrived"""
+        self.wakeup.set()
+
+    def trigger(self):
+        """Mine the pending votes as soon as possible, whatever their number"""
+        self.triggered = True
+        self.nudge()
+
+    def delay(self):
+        """Seconds until a block is due: 0 to mine now, None to wait for votes"""
+        pending = self.blockchain.pending_votes
+        if not pending:
+            return None
+        if self.triggered:
+            return 0
+        min_votes = self.blockchain.block_size if self.min_votes is None else self.min_votes
+        if len(pending) >= min_votes:
+            return 0
+        if not self.max_wait:
+            return None
+        oldest = pending.oldest()
+        if oldest is None:
+            return None
+        return max(0, oldest + self.max_wait - monotonic())
+
+    def _run(self):
+        while self.running:
+            delay = self.delay()
+            if delay != 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+            try:
+                block = self.blockchain.new_block(0, None)
+            except Exception as e:
+                print(f"Mining failed: {e}")
+                self.wakeup.wait(1)
+                continue
+            if block is None:
+                print("Mining aborted, rebasing onto the new tip")
+            else:
+                self.triggered = False
+                print(f"Mined block {block['index']} with {len(block['votes'])} votes")
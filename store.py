@@ -0,0 +1,168 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+import codec
+
+# offset and length of the block's line in blocks.log, then its raw sha256
+INDEX_RECORD = struct.Struct('<QI32s')
+
+
+class ChainStore:
+    """Append-only on-disk chain with a fixed-width offset index.
+
+    blocks.log holds the blocks back to back in codec encoding (older logs
+    hold one JSON block per line, which still decodes) and blocks.idx one
+    INDEX_RECORD per block, so block i lives at idx[i * INDEX_RECORD.size].
+    Blocks are only ever appended, except that a chain swap truncates the
+    divergent suffix first. Every block in the log was validated before it was
+    written, so load() trusts it and takes the stored hash as is.
+
+    votes.log holds the pending-vote mempool as a log of JSON lines: a vote
+    that entered it, or {"removed": [signed_hash, ...]} for votes that left.
+    Once removals make up most of the log it is compacted to the live votes.
+
+    signers.json holds the votes per signer_id on the chain as of a given
+    block, so a restart only has to count the blocks stored after it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, 'blocks.log')
+        self.index_path = os.path.join(directory, 'blocks.idx')
+        self.votes_path = os.path.join(directory, 'votes.log')
+        self.signers_path = os.path.join(directory, 'signers.json')
+        for path in (self.log_path, self.index_path, self.votes_path):
+            open(path, 'ab').close()
+        self.height = self._repair()
+        self.log = open(self.log_path, 'ab')
+        self.index = open(self.index_path, 'ab')
+        self.votes = open(self.votes_path, 'ab')
+        self.votes_lock = threading.Lock()
+        self.vote_records = 0  # lines in votes.log, live or not
+
+    def _repair(self):
+        """Drop a torn tail left by a crash mid-append, return the block count"""
+        log_size = os.path.getsize(self.log_path)
+        with open(self.index_path, 'rb') as f:
+            records = f.read()
+        height = len(records) // INDEX_RECORD.size
+        while height:
+            offset, length, _ = INDEX_RECORD.unpack_from(records, (height - 1) * INDEX_RECORD.size)
+            if offset + length <= log_size:
+                break
+            height -= 1
+        end = 0
+        if height:
+            offset, length, _ = INDEX_RECORD.unpack_from(records, (height - 1) * INDEX_RECORD.size)
+            end = offset + length
+        os.truncate(self.index_path, height * INDEX_RECORD.size)
+        os.truncate(self.log_path, end)
+        return height
+
+    def load(self):
+        """Return (blocks, hashes) for the whole stored chain"""
+        if not self.height:
+            return [], []
+        with open(self.index_path, 'rb') as f:
+            records = f.read()
+        blocks, hashes = [], []
+        with open(self.log_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            for offset, length, digest in INDEX_RECORD.iter_unpack(records):
+                blocks.append(codec.decode_block(log[offset:offset + length]))
+                hashes.append(digest.hex())
+        return blocks, hashes
+
+    def append(self, block, block_hash):
+        data = codec.encode_block(block)
+        offset = self.log.seek(0, os.SEEK_END)
+        self.log.write(data)
+        self.log.flush()
+        self.index.write(INDEX_RECORD.pack(offset, len(data), bytes.fromhex(block_hash)))
+        self.index.flush()
+        self.height += 1
+
+    def truncate(self, height):
+        """Forget every block after the first height ones"""
+        if height >= self.height:
+            return
+        end = 0
+        if height:
+            with open(self.index_path, 'rb') as f:
+                f.seek((height - 1) * INDEX_RECORD.size)
+                offset, length, _ = INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+            end = offset + length
+        self.log.truncate(end)
+        self.index.truncate(height * INDEX_RECORD.size)
+        self.height = height
+
+    def load_votes(self):
+        """Replay votes.log, return the votes still pending in the order they came"""
+        votes, records = {}, 0
+        with open(self.votes_path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                records += 1
+                record = json.loads(line)
+                if 'removed' in record:
+                    for key in record['removed']:
+                        votes.pop(key, None)
+                else:
+                    votes[str(record['signed_hash'])] = record
+        self.vote_records = records
+        return list(votes.values())
+
+    def append_votes(self, votes):
+        lines = [json.dumps(vote).encode() + b'\n' for vote in votes]
+        if not lines:
+            return
+        with self.votes_lock:
+            self.votes.writelines(lines)
+            self.votes.flush()
+            self.vote_records += len(lines)
+
+    def remove_votes(self, keys, pending):
+        """Log that the votes with these signed_hash keys left the mempool.
+
+        pending is the mempool as it is now; when the log holds far more
+        records than it has votes, the log is rewritten from it.
+        """
+        keys = list(keys)
+        if keys:
+            with self.votes_lock:
+                self.votes.write(json.dumps({'removed': keys}).encode() + b'\n')
+                self.votes.flush()
+                self.vote_records += 1
+        if self.vote_records > 2 * len(pending) + 1024:
+            self.write_votes(pending)
+
+    def write_votes(self, votes):
+        """Rewrite votes.log to hold just votes"""
+        tmp_path = self.votes_path + '.tmp'
+        lines = [json.dumps(vote).encode() + b'\n' for vote in votes]
+        with self.votes_lock:  # request threads append while the writer rewrites
+            with open(tmp_path, 'wb') as f:
+                f.writelines(lines)
+            self.votes.close()
+            os.replace(tmp_path, self.votes_path)
+            self.votes = open(self.votes_path, 'ab')
+            self.vote_records = len(lines)
+
+    def load_signer_counts(self):
+        """{'height', 'block_hash', 'counts'} as last written, None if there is none"""
+        try:
+            with open(self.signers_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_signer_counts(self, height, block_hash, counts):
+        """Save the votes per signer on the chain up to block height, whose hash is block_hash"""
+        tmp_path = self.signers_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'height': height, 'block_hash': block_hash, 'counts': counts}, f)
+        os.replace(tmp_path, self.signers_path)
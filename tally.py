@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import requests
+
+import codec
+
+INVALID = '<invalid>'  # counted for ciphertexts that don't decrypt to a ballot
+
+
+def candidate_of(plaintext):
+    """The candidate a decrypted ballot names, INVALID if it names none"""
+    try:
+        candidate = json.loads(plaintext)['candidate']
+    except (ValueError, TypeError, KeyError):
+        return INVALID
+    return candidate if isinstance(candidate, str) else INVALID
+
+
+class Tally:
+    """Per-candidate counts over the finalized blocks of a node's chain.
+
+    Each sync asks the node where our tallied blocks and its chain part
+    ways, undoes the blocks past that point, then fetches only the newly
+    finalized blocks and decrypts their votes in one batch through decrypt
+    (which returns a ballot's plaintext or None). Every block's
+    contribution is kept with its hash, so a fork swap costs as much as
+    the blocks it replaces, never a recount. A vote is counted once, in
+    the first block that holds it; the signed_hashes each block counted are
+    kept with it, so a rollback frees them again.
+
+    A block is finalized once it has finality confirmations. With a
+    checkpoint path, applied blocks are appended to it as JSON lines and
+    reloaded on start.
+    """
+
+    def __init__(self, node, decrypt, finality=1, checkpoint=None, page=500):
+        self.node = node
+        self.decrypt = decrypt
+        self.finality = finality
+        self.checkpoint = checkpoint
+        self.page = page  # blocks fetched per request
+        self.blocks = []  # [index, hash, {candidate: votes}, [signed_hash]] for every tallied block, in chain order
+        self.counts = Counter()
+        self.counted = set()  # signed_hashes of the votes in counts
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        if checkpoint and os.path.exists(checkpoint):
+            self.load()
+
+    def load(self):
+        with open(self.checkpoint) as f:
+            for line in f:
+                if line.strip():
+                    self.blocks.append(json.loads(line))
+        if any(len(entry) < 4 for entry in self.blocks):
+            print(f"{self.checkpoint} doesn't say which votes it counted, recounting from the start")
+            self.blocks = []
+            self.rewrite_checkpoint()
+            return
+        for _, _, delta, keys in self.blocks:
+            self.counts.update(delta)
+            self.counted.update(keys)
+        print(f"Loaded tally of {len(self.blocks)} blocks from {self.checkpoint}")
+
+    def rewrite_checkpoint(self):
+        tmp = self.checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            for block in self.blocks:
+                f.write(json.dumps(block) + '\n')
+        os.replace(tmp, self.checkpoint)
+
+    def locator(self):
+        """[index, hash] pairs of our tallied blocks, dense near the tip and doubling after"""
+        locator = []
+        position, step = len(self.blocks) - 1, 1
+        while position >= 0:
+            index, block_hash = self.blocks[position][:2]
+            locator.append([index, block_hash])
+            if len(locator) >= 10:
+                step *= 2
+            position -= step
+        return locator
+
+    def rollback(self, fork):
+        """Forget the blocks after index fork"""
+        if len(self.blocks) <= fork:
+            return
+        with self.lock:
+            for _, _, delta, keys in self.blocks[fork:]:
+                self.counts.subtract(delta)
+                self.counted.difference_update(keys)
+            self.counts = +self.counts  # drop candidates back at zero
+            del self.blocks[fork:]
+        print(f"Tally rolled back to block {fork}")
+        if self.checkpoint:
+            self.rewrite_checkpoint()
+
+    def fetch_blocks(self, start, end):
+        response = self.session.get(f'http://{self.node}/blocks', params={'start': start, 'end': end},
+                                    headers={'Accept': codec.BLOCKS_MIMETYPE}, timeout=30, stream=True)
+        response.raise_for_status()
+        return list(codec.decode_blocks(response.iter_content(1 << 16)))
+
+    def sync(self):
+        """Catch up with the node's finalized blocks, return how many votes were counted"""
+        response = self.session.post(f'http://{self.node}/blocks/locate', json={'locator': self.locator()},
+                                     timeout=30)
+        response.raise_for_status()
+        located = response.json()
+        self.rollback(located['fork'])
+
+        final = located['length'] - self.finality + 1
+        counted = 0
+        while len(self.blocks) < final:
+            start = len(self.blocks) + 1
+            blocks = self.fetch_blocks(start, min(final, start + self.page - 1))
+            if not blocks:
+                break
+            counted += self.apply(blocks)
+        return counted
+
+    def apply(self, blocks):
+        """Count blocks that extend our tallied chain; stops at the first that doesn't"""
+        hashes = []
+        previous = self.blocks[-1][1] if self.blocks else None
+        for block in blocks:
+            block_hash = hashlib.sha256(codec.preimage(block)).hexdigest()
+            if block['index'] != len(self.blocks) + len(hashes) + 1 or previous and block['previous_hash'] != previous:
+                break  # the node switched forks under us, the next sync rolls back
+            hashes.append(block_hash)
+            previous = block_hash
+        blocks = blocks[:len(hashes)]
+
+        keys, ciphertexts = [], []  # per block, the signed_hashes it counts first
+        batch = set()
+        for block in blocks:
+            keys.append([])
+            for vote in block['votes']:
+                key = str(vote['signed_hash'])
+                if key in self.counted or key in batch:
+                    continue  # a repeat of a vote already counted
+                batch.add(key)
+                keys[-1].append(key)
+                ciphertexts.append(vote['encrypted_vote'])
+        plaintexts = iter(self.decrypt(ciphertexts))
+        applied = []
+        for block, block_hash, block_keys in zip(blocks, hashes, keys):
+            delta = Counter(candidate_of(next(plaintexts)) for _ in block_keys)
+            applied.append([block['index'], block_hash, dict(delta), block_keys])
+
+        with self.lock:
+            for entry in applied:
+                self.counts.update(entry[2])
+                self.counted.update(entry[3])
+            self.blocks.extend(applied)
+        if self.checkpoint and applied:
+            with open(self.checkpoint, 'a') as f:
+                for entry in applied:
+                    f.write(json.dumps(entry) + '\n')
+        return len(ciphertexts)
+
+    def results(self):
+        with self.lock:
+            tip = self.blocks[-1] if self.blocks else (0, None, None)
+            return {
+                'counts': dict(self.counts),
+                'votes': sum(self.counts.values()),
+                'height': tip[0],
+                'block_hash': tip[1],
+            }
+
+    def follow(self, interval=2):
+        """Sync forever on a background thread"""
+        def loop():
+            while True:
+                try:
+                    counted = self.sync()
+                    if counted:
+                        print(f"Tallied {counted} new votes up to block {len(self.blocks)}")
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    print(f"Tally couldn't sync with {self.node}: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name='tally', daemon=True).start()
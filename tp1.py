@@ -1,13 +1,63 @@
-import socket
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_OAEP
 
+from framing import FramedServer
+from tally import Tally
+
+_cipher = None
+
+
+def _init_worker(key):
+    global _cipher
+    _cipher = PKCS1_OAEP.new(RSA.import_key(key))
+
+
+def _encrypt(message, cipher=None):
+    return (cipher or _cipher).encrypt(message.encode()).hex()
+
+
+def _decrypt(ciphertext, cipher=None):
+    try:
+        return (cipher or _cipher).decrypt(bytes.fromhex(ciphertext)).decode()
+    except (ValueError, TypeError):
+        return None
+
+
 class TP1Server:
-    def __init__(self):
+    def __init__(self, workers=None):
         self.key = RSA.generate(2048)
         self.public_key = self.key.publickey()
         self.cipher = PKCS1_OAEP.new(self.key)
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+        self.tally = None
+
+    def map(self, fn, items):
+        """fn over items, on the process pool once there are enough of them"""
+        if len(items) < 2 * self.workers:
+            return [fn(item, self.cipher) for item in items]
+        if self.pool is None:
+            # Workers get the private key too: they decrypt ballots for the tally
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                            initargs=(self.key.export_key(),))
+        chunksize = max(1, len(items) // (self.workers * 4))
+        return list(self.pool.map(fn, items, chunksize=chunksize))
+
+    def encrypt_batch(self, messages):
+        """Encrypt many votes, spreading the RSA work over a process pool"""
+        return self.map(_encrypt, messages)
+
+    def decrypt_batch(self, ciphertexts):
+        """Plaintext of each hex ciphertext, None where it doesn't decrypt"""
+        return self.map(_decrypt, ciphertexts)
+
+    def follow(self, node, finality=1, checkpoint=None):
+        """Keep a running tally of node's finalized blocks"""
+        self.tally = Tally(node, self.decrypt_batch, finality, checkpoint)
+        self.tally.follow()
 
     def handle_request(self, data):
         try:
@@ -15,26 +65,31 @@ class TP1Server:
             if request["type"] == "encrypt_vote":
                 encrypted = self.cipher.encrypt(request["message"].encode())
                 return {"encrypted_vote": encrypted.hex()}
+            if request["type"] == "encrypt_votes":
+                return {"encrypted_votes": self.encrypt_batch(request["messages"])}
+            if request["type"] == "tally":
+                if self.tally is None:
+                    return {"error": "Not tallying"}
+                return self.tally.results()
             return {"error": "Invalid request type"}
         except Exception as e:
             return {"error": str(e)}
 
     def run(self):
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.bind(("127.0.0.1", 5001))
-        server.listen(5)
+        server = FramedServer(("127.0.0.1", 5001), self.handle_request)
         print("🔒 TP1 Encryption Service running on port 5001")
-        
-        while True:
-            client, addr = server.accept()
-            try:
-                data = client.recv(4096).decode()
-                response = self.handle_request(data)
-                client.send(json.dumps(response).encode())
-            except Exception as e:
-                client.send(json.dumps({"error": str(e)}).encode())
-            finally:
-                client.close()
+        server.serve_forever()
 
 if __name__ == "__main__":
-    TP1Server().run()
\ No newline at end of file
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--node', default='127.0.0.1:6001', help='node whose chain to tally, empty to not tally')
+    parser.add_argument('--finality', default=1, type=int, help='confirmations before a block is tallied')
+    parser.add_argument('--checkpoint', default=None, help='file to keep the tally in across restarts')
+    args = parser.parse_args()
+
+    server = TP1Server()
+    if args.node:
+        server.follow(args.node, args.finality, args.checkpoint)
+    server.run()
@@ -1,44 +1,144 @@
-import socket
 import json
+import os
 import random
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from Crypto.PublicKey import RSA
 
+from framing import FramedServer
+
+
+class BlindSigner:
+    """Blinded RSA signing using CRT, with a stock of precomputed blinding pairs.
+
+    Each signature is blinded by a fresh r, so the private-key exponentiation
+    never runs on the raw hash, and the result is the same h^d mod n the plain
+    computation gives. Pairs (r^e, r^-1) are drawn from a stock that a
+    background thread keeps topped up; an empty stock falls back to computing
+    one inline.
+    """
+
+    def __init__(self, n, e, d, p, q, stock=0):
+        self.n, self.e = n, e
+        self.p, self.q = p, q
+        self.dp = d % (p - 1)
+        self.dq = d % (q - 1)
+        self.q_inv = pow(q, -1, p)
+        self.stock = stock
+        self.pairs = deque()
+        self.refill = threading.Event()
+        if stock:
+            threading.Thread(target=self._keep_stocked, daemon=True).start()
+            self.refill.set()
+
+    def new_pair(self):
+        r = random.randint(2, self.n - 1)
+        return pow(r, self.e, self.n), pow(r, -1, self.n)
+
+    def _keep_stocked(self):
+        while True:
+            self.refill.wait()
+            self.refill.clear()
+            while len(self.pairs) < self.stock:
+                self.pairs.append(self.new_pair())
+
+    def blinding_pair(self):
+        try:
+            return self.pairs.popleft()
+        except IndexError:
+            return self.new_pair()
+        finally:
+            if self.stock:
+                self.refill.set()
+
+    def private_op(self, c):
+        """c^d mod n via the Chinese remainder theorem"""
+        m1 = pow(c % self.p, self.dp, self.p)
+        m2 = pow(c % self.q, self.dq, self.q)
+        h = (self.q_inv * (m1 - m2)) % self.p
+        return m2 + h * self.q
+
+    def sign(self, hash_int):
+        r_e, r_inv = self.blinding_pair()
+        blinded = (hash_int * r_e) % self.n
+        blinded_sig = self.private_op(blinded)
+        return (blinded_sig * r_inv) % self.n
+
+
+_signer = None
+
+
+def _init_worker(numbers):
+    global _signer
+    _signer = BlindSigner(*numbers)
+
+
+def _sign(hash_hex):
+    return _signer.sign(int(hash_hex, 16))
+
+
+def load_or_create_key(path):
+    """The RSA key saved at path, generated and saved there (public half at path.pub) if there is none"""
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            return RSA.import_key(f.read())
+    key = RSA.generate(2048)
+    if path:
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(key.export_key())
+        with open(path + '.pub', 'wb') as f:
+            f.write(key.publickey().export_key())
+        print(f"Saved a new signing key to {path}, nodes can pin {path}.pub with --signer-key")
+    return key
+
+
 class TP2Server:
-    def __init__(self):
-        self.key = RSA.generate(2048)
+    def __init__(self, workers=None, key_path=None):
+        self.key = load_or_create_key(key_path)
         self.public_key = self.key.publickey()
         self.signerID = 33#random.random(2)#signerID added later
+        self.signer = BlindSigner(self.key.n, self.key.e, self.key.d, self.key.p, self.key.q, stock=256)
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+
+    def sign_batch(self, hashes):
+        """Sign many hashes, spreading the private-key work over a process pool"""
+        if len(hashes) < 2 * self.workers:
+            return [self.signer.sign(int(h, 16)) for h in hashes]
+        if self.pool is None:
+            numbers = (self.key.n, self.key.e, self.key.d, self.key.p, self.key.q)
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(numbers,))
+        chunksize = max(1, len(hashes) // (self.workers * 4))
+        return list(self.pool.map(_sign, hashes, chunksize=chunksize))
 
     def handle_request(self, data):
         try:
             request = json.loads(data)
             if request["type"] == "blind_sign":
                 hash_int = int(request["hash"], 16)
-                blinding_factor = random.randint(2, self.key.n - 1)
-                blinded = (hash_int * pow(blinding_factor, self.public_key.e, self.key.n)) % self.key.n
-                blinded_sig = pow(blinded, self.key.d, self.key.n)
-                unblinded_sig = (blinded_sig * pow(blinding_factor, -1, self.key.n)) % self.key.n
+                unblinded_sig = self.signer.sign(hash_int)
                 return {"signature": unblinded_sig, "signerID": self.signerID}#signerID added extra
+            if request["type"] == "public_key":
+                return {"n": self.public_key.n, "e": self.public_key.e, "signerID": self.signerID}
+            if request["type"] == "blind_sign_batch":
+                return {"signatures": self.sign_batch(request["hashes"]), "signerID": self.signerID}
             return {"error": "Invalid request type"}
         except Exception as e:
             return {"error": str(e)}
 
     def run(self):
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.bind(("127.0.0.1", 5002))
-        server.listen(5)
+        server = FramedServer(("127.0.0.1", 5002), self.handle_request)
         print("✍️ TP2 Blind Signing Service running on port 5002")
-        
-        while True:
-            client, addr = server.accept()
-            try:
-                data = client.recv(4096).decode()
-                response = self.handle_request(data)
-                client.send(json.dumps(response).encode())
-            except Exception as e:
-                client.send(json.dumps({"error": str(e)}).encode())
-            finally:
-                client.close()
+        server.serve_forever()
 
 if __name__ == "__main__":
-    TP2Server().run()
\ No newline at end of file
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--key', default='tp2_key.pem',
+                        help='file the signing key is kept in across restarts, created if missing; '
+                             'empty for a new key each run')
+    args = parser.parse_args()
+
+    TP2Server(key_path=args.key).run()
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic
+
+from Crypto.PublicKey import RSA
+
+from framing import recv_message, send_message
+
+
+def check_signature(n, e, signed_hash, encrypted_vote):
+    """Why the TP2 signature on a vote is bad, or None if it holds"""
+    try:
+        digest = int(hashlib.sha256(bytes.fromhex(encrypted_vote)).hexdigest(), 16)
+        signature = int(signed_hash)
+    except (TypeError, ValueError):
+        return 'Malformed vote signature'
+    if not 0 < signature < n or pow(signature, e, n) != digest:
+        return 'Invalid vote signature'
+    return None
+
+
+def _check(item):
+    return check_signature(*item)
+
+
+class SignatureVerifier:
+    """Verifies that each vote's signed_hash is its signer's RSA signature
+    over SHA-256 of encrypted_vote.
+
+    Keys pinned with pin_key, e.g. from the .pub file TP2 saves, are the
+    only ones trusted for their signer. Otherwise signers maps a signer_id
+    to the (host, port) of the TP2 that owns it; its public key is fetched
+    from there on first use and kept until the verifier restarts. A failed
+    fetch isn't retried for a while, doubling up to max_backoff seconds, so
+    an unreachable TP2 costs one timeout rather than one per vote. Batches
+    big enough to be worth it are verified on a process pool.
+    """
+
+    max_backoff = 60
+
+    def __init__(self, signers, workers=None):
+        self.signers = {str(k): v for k, v in signers.items()}
+        self.keys = {}
+        self.failures = {}  # signer_id -> (monotonic time to retry at, backoff in seconds)
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+
+    def pin_key(self, signer_id, path):
+        """Trust only the RSA public key in the PEM file at path for signer_id"""
+        with open(path, 'rb') as f:
+            key = RSA.import_key(f.read())
+        self.keys[str(signer_id)] = (key.n, key.e)
+
+    def public_key(self, signer_id):
+        """(n, e) for signer_id, or None if we can't get hold of it"""
+        signer_id = str(signer_id)
+        if signer_id not in self.keys:
+            address = self.signers.get(signer_id)
+            if address is None:
+                return None
+            retry_at, backoff = self.failures.get(signer_id, (0, 0))
+            if monotonic() < retry_at:
+                return None
+            try:
+                with socket.create_connection(address, timeout=5) as s:
+                    send_message(s, {"type": "public_key"})
+                    response = recv_message(s)
+                self.keys[signer_id] = (response["n"], response["e"])
+            except (OSError, ValueError, KeyError) as e:
+                backoff = min(max(1, 2 * backoff), self.max_backoff)
+                self.failures[signer_id] = (monotonic() + backoff, backoff)
+                print(f"Couldn't fetch public key of signer {signer_id}, retrying in {backoff}s: {e}")
+                return None
+            self.failures.pop(signer_id, None)
+        return self.keys[signer_id]
+
+    def verify(self, votes):
+        """An error message per vote, None where the signature holds"""
+        errors = [None] * len(votes)
+        items, positions = [], []
+        keys = {}  # each signer is looked up once per batch
+        for position, vote in enumerate(votes):
+            signer_id = str(vote.get('signer_id'))
+            if signer_id not in keys:
+                keys[signer_id] = self.public_key(signer_id)
+            key = keys[signer_id]
+            if key is None:
+                errors[position] = 'Unknown signer'
+                continue
+            items.append((*key, vote.get('signed_hash'), vote.get('encrypted_vote')))
+            positions.append(position)
+
+        if len(items) < 64 or self.workers <= 1:
+            results = map(_check, items)
+        else:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers)
+            results = self.pool.map(_check, items, chunksize=max(1, len(items) // (self.workers * 4)))
+        for position, error in zip(positions, results):
+            errors[position] = error
+        return errors
@@ -3,15 +3,66 @@ import json
 import random
 import time
 import hashlib
+import struct
 from Crypto.Hash import SHA256
 import argparse
 
+import codec
+from framing import recv_message, send_message
+from miner import meets_target
+
+
+def check_inclusion(vote, proof, headers, retarget_window=codec.RETARGET_WINDOW):
+    """Confirmations a miner's evidence proves for vote, 0 if it doesn't hold up.
+
+    The Merkle proof must lead from the vote to the votes_root of the proof's
+    block header, and headers, running from that block to the tip, must link
+    up and meet their difficulty. That difficulty can't be below the minimum,
+    and only changes from the parent's every retarget_window blocks, by at
+    most the clamp the miners retarget with.
+    """
+    try:
+        header = proof["header"]
+        leaf = codec.merkle_leaf(vote)
+        if not codec.verify_merkle_proof(leaf, proof["proof"], header["votes_root"]):
+            return 0
+        if not headers or headers[0] != header:
+            return 0
+        previous_hash = header["previous_hash"]
+        parent = None
+        for h in headers:
+            difficulty = codec.difficulty(h)
+            if difficulty < codec.MIN_DIFFICULTY:
+                return 0
+            if parent is not None and not allowed_difficulty(parent, h, retarget_window):
+                return 0
+            digest = hashlib.sha256(codec.header(h)).digest()
+            if h["previous_hash"] != previous_hash or not meets_target(digest, codec.target(h)):
+                return 0
+            previous_hash = digest.hex()
+            parent = h
+        return len(headers)
+    except (KeyError, TypeError, ValueError, ZeroDivisionError, struct.error):
+        return 0
+
+
+def allowed_difficulty(parent, h, retarget_window):
+    """Whether h's difficulty can follow parent's, as far as headers alone tell"""
+    before, after = codec.difficulty(parent), codec.difficulty(h)
+    if parent.get("version", codec.JSON_VERSION) < codec.DIFFICULTY_VERSION:
+        return after == codec.DEFAULT_DIFFICULTY
+    if (h["index"] - 1) % retarget_window:
+        return after == before
+    return before // codec.RETARGET_CLAMP <= after <= before * codec.RETARGET_CLAMP
+
+
 class Voter:
-    def __init__(self, voter_id, candidate_id, miner_addresses, m):
+    def __init__(self, voter_id, candidate_id, miner_addresses, m, confirmations=1):
         self.voter_id = voter_id
         self.candidate_id = candidate_id
         self.miner_addresses = miner_addresses
         self.m = m
+        self.confirmations = confirmations
         self.encrypted_vote = None
         self.unblinded_signed_hash = None
         # self.vote_id = None
@@ -58,14 +109,17 @@ class Voter:
             f"{self.encrypted_vote.hex()}{self.unblinded_signed_hash}".encode()
         ).hexdigest()
 
-    def broadcast_vote(self):
-        """Send vote to multiple miners"""
-        vote_package = {
+    def vote_package(self):
+        return {
             # "vote_id": self.vote_id,
             "signer_id": self.signer_id,
             "encrypted_vote": self.encrypted_vote.hex(),
             "signed_hash": self.unblinded_signed_hash
         }
+
+    def broadcast_vote(self):
+        """Send vote to multiple miners"""
+        vote_package = self.vote_package()
         
         successes = 0
         for miner in random.sample(self.miner_addresses, len(self.miner_addresses)):
@@ -85,50 +139,88 @@ class Voter:
         raise Exception(f"Only reached {successes}/{self.m} required miners")
 
     def confirm_vote_inclusion(self):
-        """Check if vote was included in blockchain"""
+        """Wait for the vote to be mined, then for it to reach enough confirmations"""
         print(f"🔍 {self.voter_id} checking for vote inclusion...")
         start_time = time.time()
         timeout = 120  # 2 minute timeout
+        mined = None
         
         while time.time() - start_time < timeout:
             for miner in self.miner_addresses:
+                # Long-poll: the miner answers as soon as the chain satisfies us, or after wait seconds
+                wait = max(1, min(30, int(timeout - (time.time() - start_time))))
                 try:
-                    chain = self.send_flask_request(miner[0], miner[1], {
-                        "type": "get_blockchain"
-                    })
-                    # print(f"voter- {self.voter_id} received: {chain['blockchain']}")#comment out
-                    for block in json.loads(chain["blockchain"]):
-                        for vote in block.get("votes", []):
-                            # if vote.get("vote_id") == self.vote_id:
-                            if vote.get("signed_hash") == self.unblinded_signed_hash:
-                                print(f"✅ {self.voter_id} vote confirmed in block {block['index']}")
-                                return True
+                    response = self.send_flask_request(miner[0], miner[1], {
+                        "type": "wait_vote",
+                        "signed_hash": self.unblinded_signed_hash,
+                        "confirmations": self.confirmations if mined else 1,
+                        "wait": wait
+                    }, timeout=wait + 5)
                 except Exception:
                     continue
-            
-            time.sleep(5)  # Check every 5 seconds
+                if "block" not in response:
+                    continue
+                if mined != response["block"]:
+                    mined = response["block"]
+                    print(f"⛏️ {self.voter_id} vote mined in block {mined}")
+                if response["confirmations"] >= self.confirmations:
+                    confirmations = self.verify_inclusion(miner)
+                    if confirmations >= self.confirmations:
+                        print(f"✅ {self.voter_id} vote confirmed in block {mined} "
+                              f"({confirmations} confirmations, proof checked)")
+                        return True
+                    print(f"⚠️ {self.voter_id} couldn't verify inclusion proof from miner {miner}")
+            time.sleep(1)  # every miner was unreachable or timed out, don't spin
         
-        raise Exception(f"Vote not found in blockchain after {timeout} seconds")
+        raise Exception(f"Vote not confirmed in blockchain after {timeout} seconds")
+
+    def verify_inclusion(self, miner):
+        """Check the vote's inclusion as a light client, return its confirmations.
+
+        Only headers and the Merkle proof are downloaded from the miner, never
+        whole blocks; check_inclusion does the checking.
+        """
+        try:
+            proof = self.send_flask_request(miner[0], miner[1], {
+                "type": "vote_proof",
+                "signed_hash": self.unblinded_signed_hash
+            })
+            headers = self.send_flask_request(miner[0], miner[1], {
+                "type": "headers",
+                "start": proof["header"]["index"]
+            })["headers"]
+            return check_inclusion(self.vote_package(), proof, headers)
+        except Exception:
+            return 0
 
     def send_request(self, host, port, data):
         """Generic request sender"""
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.settimeout(5)
             s.connect((host, port))
-            s.sendall(json.dumps(data).encode())
-            return json.loads(s.recv(8192).decode())
+            send_message(s, data)
+            return recv_message(s)
         
-    def send_flask_request(self, host, port, data):
+    def send_flask_request(self, host, port, data, timeout=5):
         """Send properly formatted HTTP request"""
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5)
+                s.settimeout(timeout)
                 s.connect((host, port))
                 
                 if data.get("type") == "add_vote":
                     x=f"POST /vote/add HTTP/1.1\r\n"
                 elif data.get("type") == "get_blockchain":
                     x=f"GET /get_blockchain HTTP/1.1\r\n"
+                elif data.get("type") == "find_vote":
+                    x=f"GET /votes/{data['signed_hash']} HTTP/1.1\r\n"
+                elif data.get("type") == "vote_proof":
+                    x=f"GET /votes/{data['signed_hash']}/proof HTTP/1.1\r\n"
+                elif data.get("type") == "headers":
+                    x=f"GET /headers?start={data['start']} HTTP/1.1\r\n"
+                elif data.get("type") == "wait_vote":
+                    x=(f"GET /votes/{data['signed_hash']}/wait"
+                       f"?confirmations={data['confirmations']}&timeout={data['wait']} HTTP/1.1\r\n")
                 else:
                     x=f"POST /vote/new HTTP/1.1\r\n"
                 # Format as proper HTTP request
@@ -164,6 +256,7 @@ def main():
     parser = argparse.ArgumentParser(description="Run a voter node")
     parser.add_argument("--voter", type=int, required=True, help="Voter ID number")
     parser.add_argument("--candidate", type=str, required=True, help="Candidate name")
+    parser.add_argument("--confirmations", type=int, default=1, help="Blocks to wait for on top of the vote")
     
     args = parser.parse_args()
     
@@ -176,7 +269,8 @@ def main():
         voter_id=f"Voter{args.voter}",
         candidate_id=args.candidate,
         miner_addresses=miners,
-        m=min_confirmations
+        m=min_confirmations,
+        confirmations=args.confirmations
     )
 
 if __name__ == "__main__":